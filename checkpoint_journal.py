@@ -0,0 +1,74 @@
+import os
+import sqlite3
+from datetime import datetime
+
+# Per-invoice step journal kept in a local SQLite file, so an interrupted run
+# can resume each invoice from its last completed step instead of redoing SAP work.
+
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoint_journal.sqlite3")
+
+# Steps in pipeline order
+CLAIMED = "claimed"             # Row set to TilFakturering
+CSV_WRITTEN = "csv"             # Invoice file generated
+TEST_OK = "test_ok"             # ZFI_FAKTURAGRUNDLAG test run passed; the update run is next
+ORDERED = "ordered"             # Standardordre saved, order number known
+RELEASED = "released"           # Billing released in ZVF04
+DB_COMMITTED = "db_committed"   # Row set to Faktureret
+DONE = "done"                   # Vejman case updated (or no Vejman case)
+ABANDONED = "abandoned"         # Row no longer claimable; nothing to resume
+
+STEPS = (CLAIMED, CSV_WRITTEN, TEST_OK, ORDERED, RELEASED, DB_COMMITTED, DONE)
+FINAL_STEPS = (DONE, ABANDONED)
+
+
+def open_journal(path: str = JOURNAL_PATH) -> sqlite3.Connection:
+    journal = sqlite3.connect(path)
+    journal.row_factory = sqlite3.Row
+    journal.execute("""
+        CREATE TABLE IF NOT EXISTS journal (
+            invoice_id   INTEGER PRIMARY KEY,
+            vejman_id    TEXT,
+            step         TEXT NOT NULL,
+            csv_path     TEXT,
+            ordernumber  TEXT,
+            updated_at   TEXT NOT NULL
+        )
+    """)
+    journal.commit()
+    return journal
+
+
+def record_step(journal: sqlite3.Connection, invoice_id, step: str, vejman_id=None, csv_path=None, ordernumber=None):
+    """Record that an invoice completed a step. Fields left as None keep their stored value."""
+    if step not in STEPS and step not in FINAL_STEPS:
+        raise ValueError(f"Ukendt journal-trin: {step}")
+    journal.execute("""
+        INSERT INTO journal (invoice_id, vejman_id, step, csv_path, ordernumber, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(invoice_id) DO UPDATE SET
+            step        = excluded.step,
+            vejman_id   = COALESCE(excluded.vejman_id, journal.vejman_id),
+            csv_path    = COALESCE(excluded.csv_path, journal.csv_path),
+            ordernumber = COALESCE(excluded.ordernumber, journal.ordernumber),
+            updated_at  = excluded.updated_at
+    """, (invoice_id, vejman_id, step, csv_path, ordernumber, datetime.now().isoformat(timespec="seconds")))
+    journal.commit()
+
+
+def in_flight(journal: sqlite3.Connection):
+    """Invoices that were started but not finished, oldest first."""
+    placeholders = ", ".join("?" for _ in FINAL_STEPS)
+    return journal.execute(
+        f"SELECT * FROM journal WHERE step NOT IN ({placeholders}) ORDER BY updated_at, invoice_id",
+        FINAL_STEPS,
+    ).fetchall()
+
+
+def get_entry(journal: sqlite3.Connection, invoice_id):
+    """The journal entry for an invoice, or None."""
+    return journal.execute("SELECT * FROM journal WHERE invoice_id = ?", (invoice_id,)).fetchone()
+
+
+def step_reached(entry_step: str, step: str) -> bool:
+    """True if entry_step is at or past step in pipeline order."""
+    return STEPS.index(entry_step) >= STEPS.index(step)
@@ -0,0 +1,172 @@
+import os
+import socket
+import threading
+import pyodbc
+
+# Claim leases for VejmanFakturering rows in 'TilFakturering'.
+# A claim records the owning robot and an expiry that a heartbeat keeps pushing
+# forward while SAP work continues. Expired claims where SAP work has not started
+# go back to 'Afsendt'; claims past that point are left for the owner's resume path.
+#
+# Required columns (added by ensure_lease_columns):
+#   ClaimOwner   nvarchar(100) NULL
+#   ClaimExpires datetime2     NULL  (UTC)
+#   ClaimStep    nvarchar(20)  NULL  ('claimed' until the update run posts to SAP, then 'posting')
+
+# One robot per machine; the journal that resumes its work is local to the machine
+OWNER = os.getenv("VejmanKassenRobotId") or socket.gethostname()
+LEASE_SECONDS = 600
+HEARTBEAT_SECONDS = 60
+
+STEP_CLAIMED = "claimed"
+STEP_POSTING = "posting"
+
+
+class LeaseLost(RuntimeError):
+    """The row is no longer claimed by this robot; it must not be touched or posted."""
+
+
+def ensure_lease_columns(conn: pyodbc.Connection):
+    cursor = conn.cursor()
+    cursor.execute("""
+        IF COL_LENGTH('dbo.VejmanFakturering', 'ClaimOwner') IS NULL
+            ALTER TABLE [VejmanKassen].[dbo].[VejmanFakturering] ADD
+                ClaimOwner   nvarchar(100) NULL,
+                ClaimExpires datetime2     NULL,
+                ClaimStep    nvarchar(20)  NULL
+    """)
+    conn.commit()
+
+
+def claim_row(cursor: pyodbc.Cursor, invoice_id) -> bool:
+    """Claim an 'Afsendt' row for this robot. False if another run got it first. Caller commits."""
+    cursor.execute("""
+        UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+        SET FakturaStatus = 'TilFakturering',
+            ClaimOwner    = ?,
+            ClaimExpires  = DATEADD(second, ?, SYSUTCDATETIME()),
+            ClaimStep     = ?
+        WHERE ID = ? AND FakturaStatus = 'Afsendt'
+    """, OWNER, LEASE_SECONDS, STEP_CLAIMED, invoice_id)
+    return cursor.rowcount == 1
+
+
+def adopt_row(cursor: pyodbc.Cursor, invoice_id) -> bool:
+    """Renew the lease on a row this robot claimed in an earlier run (or one claimed before leases existed)."""
+    cursor.execute("""
+        UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+        SET ClaimOwner   = ?,
+            ClaimExpires = DATEADD(second, ?, SYSUTCDATETIME())
+        WHERE ID = ? AND FakturaStatus = 'TilFakturering'
+          AND (ClaimOwner = ? OR ClaimOwner IS NULL)
+    """, OWNER, LEASE_SECONDS, invoice_id, OWNER)
+    return cursor.rowcount == 1
+
+
+def mark_posting(conn: pyodbc.Connection, invoice_id):
+    """
+    Record that SAP may now post an order for the row, so it is never returned to the queue.
+    Raises LeaseLost if this robot no longer holds the claim; the update run must not follow.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+        SET ClaimStep = ?
+        WHERE ID = ? AND FakturaStatus = 'TilFakturering' AND ClaimOwner = ?
+    """, STEP_POSTING, invoice_id, OWNER)
+    marked = cursor.rowcount == 1
+    conn.commit()
+    if not marked:
+        raise LeaseLost(f"Faktura {invoice_id} er ikke længere reserveret af {OWNER}")
+
+
+def renew_leases(cursor: pyodbc.Cursor) -> int:
+    cursor.execute("""
+        UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+        SET ClaimExpires = DATEADD(second, ?, SYSUTCDATETIME())
+        WHERE FakturaStatus = 'TilFakturering' AND ClaimOwner = ?
+    """, LEASE_SECONDS, OWNER)
+    return cursor.rowcount
+
+
+def reclaim_expired(cursor: pyodbc.Cursor):
+    """
+    Return expired claims that never reached SAP posting to 'Afsendt'.
+    Returns (rows returned to the queue, expired rows left for their owner to resume).
+    """
+    cursor.execute("""
+        UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+        SET FakturaStatus = 'Afsendt',
+            ClaimOwner    = NULL,
+            ClaimExpires  = NULL,
+            ClaimStep     = NULL
+        WHERE FakturaStatus = 'TilFakturering'
+          AND ClaimExpires < SYSUTCDATETIME()
+          AND ClaimStep = ?
+    """, STEP_CLAIMED)
+    returned = cursor.rowcount
+    cursor.execute("""
+        SELECT COUNT(*)
+        FROM [VejmanKassen].[dbo].[VejmanFakturering]
+        WHERE FakturaStatus = 'TilFakturering'
+          AND ClaimExpires < SYSUTCDATETIME()
+          AND ClaimStep = ?
+    """, STEP_POSTING)
+    stuck = cursor.fetchone()[0]
+    return returned, stuck
+
+
+class LeaseKeeper:
+    """
+    Background thread with its own connection: renews this robot's leases every
+    HEARTBEAT_SECONDS and returns other robots' expired claims to the queue.
+    """
+
+    def __init__(self, conn_string: str, orchestrator_connection=None, interval: float = HEARTBEAT_SECONDS):
+        self.conn_string = conn_string
+        self.orchestrator_connection = orchestrator_connection
+        self.interval = interval
+        self._last_stuck = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="claim-lease-keeper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.interval)
+
+    def _log(self, message: str):
+        if self.orchestrator_connection is not None:
+            self.orchestrator_connection.log_info(message)
+        else:
+            print(message)
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = pyodbc.connect(self.conn_string)
+                cursor = conn.cursor()
+                renew_leases(cursor)
+                returned, stuck = reclaim_expired(cursor)
+                conn.commit()
+                self._last_stuck, last_stuck = stuck, self._last_stuck
+                if returned:
+                    self._log(f"{returned} udløbne fakturakrav sat tilbage til 'Afsendt'")
+                if stuck and stuck != last_stuck:
+                    self._log(f"{stuck} udløbne fakturakrav er midt i SAP-bogføring og afventer genoptagelse")
+            except pyodbc.Error as e:
+                self._log(f"Lease-heartbeat fejlede, forbinder igen: {e}")
+                try:
+                    if conn is not None:
+                        conn.close()
+                except pyodbc.Error:
+                    pass
+                conn = None
+            self._stop.wait(self.interval)
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,106 @@
+import pyodbc
+import checkpoint_journal
+
+FAILED = "Fejl"
+
+
+def ensure_error_column(conn: pyodbc.Connection):
+    """FejlTekst holds the error (SAP texts) for rows quarantined with FakturaStatus 'Fejl'."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        IF COL_LENGTH('dbo.VejmanFakturering', 'FejlTekst') IS NULL
+            ALTER TABLE [VejmanKassen].[dbo].[VejmanFakturering] ADD FejlTekst nvarchar(max) NULL
+    """)
+    conn.commit()
+
+
+class StatusWriter:
+    """
+    Buffers FakturaStatus transitions for VejmanFakturering and writes them with
+    one executemany per statement and one commit per batch. Journal steps attached
+    to a transition are recorded only after the commit, and then on_commit is called
+    with the flushed entries, whichever call triggered the flush.
+    """
+
+    def __init__(self, conn: pyodbc.Connection, journal=None, batch_size: int = 25, on_commit=None):
+        self.conn = conn
+        self.journal = journal
+        self.batch_size = batch_size
+        self.on_commit = on_commit
+        self._invoiced = []   # (ordernumber, id)
+        self._status = []     # (status, id)
+        self._failed = []     # (error text, id)
+        self._pending = []    # (id, status, journal_step, extra)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def set_invoiced(self, invoice_id, ordernumber, journal_step=checkpoint_journal.DB_COMMITTED, **extra):
+        """Queue 'Faktureret' with today's FakturaDato and the order number."""
+        self._invoiced.append((ordernumber, invoice_id))
+        self._pending.append((invoice_id, "Faktureret", journal_step, extra))
+        return self._flush_if_full()
+
+    def set_status(self, invoice_id, status: str, journal_step=None, **extra):
+        """Queue a plain FakturaStatus change."""
+        self._status.append((status, invoice_id))
+        self._pending.append((invoice_id, status, journal_step, extra))
+        return self._flush_if_full()
+
+    def set_failed(self, invoice_id, error_text: str, journal_step=checkpoint_journal.ABANDONED, **extra):
+        """Queue 'Fejl' with the error text, for a row taken out of the queue after a failure."""
+        self._failed.append((error_text, invoice_id))
+        self._pending.append((invoice_id, FAILED, journal_step, extra))
+        return self._flush_if_full()
+
+    def _flush_if_full(self):
+        return self.flush() if len(self._pending) >= self.batch_size else []
+
+    def flush(self):
+        """
+        Write all queued transitions in one transaction.
+        Returns the flushed entries as (invoice_id, status, extra) tuples.
+        """
+        if not self._pending:
+            return []
+        cursor = self.conn.cursor()
+        cursor.fast_executemany = True
+        try:
+            if self._invoiced:
+                cursor.executemany("""
+                    UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+                    SET FakturaStatus = 'Faktureret',
+                        FakturaDato        = CAST(GETDATE() AS date),
+                        Ordrenummer        = ?
+                    WHERE ID = ?
+                """, self._invoiced)
+            if self._status:
+                cursor.executemany("""
+                    UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+                    SET FakturaStatus = ?
+                    WHERE ID = ?
+                """, self._status)
+            if self._failed:
+                cursor.executemany("""
+                    UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
+                    SET FakturaStatus = 'Fejl',
+                        FejlTekst     = ?
+                    WHERE ID = ?
+                """, self._failed)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        flushed = self._pending
+        self._invoiced, self._status, self._failed, self._pending = [], [], [], []
+        if self.journal is not None:
+            for invoice_id, _, journal_step, _ in flushed:
+                if journal_step is not None:
+                    checkpoint_journal.record_step(self.journal, invoice_id, journal_step)
+        flushed = [(invoice_id, status, extra) for invoice_id, status, _, extra in flushed]
+        if self.on_commit is not None:
+            self.on_commit(flushed)
+        return flushed
@@ -0,0 +1,74 @@
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Batch sizing for draining a large 'Afsendt' backlog. Invoices are ordered one at a
+# time (ZFI_FAKTURAGRUNDLAG), but one ZVF04 run releases the whole billing due list, so
+# the release can be shared by a batch of orders. Bigger batches amortize the release;
+# a failed release leaves the whole batch waiting, so bigger batches also cost more when
+# something goes wrong. The size grows by one after each clean release while the release
+# is still a noticeable share of the per-invoice time, and is halved after a failure.
+
+SMOOTHING = 0.3           # Weight of the newest measurement in the moving averages
+RELEASE_SHARE = 0.05      # Stop growing once the release costs less than this per invoice, relative to ordering
+MAX_FAILURE_RATE = 0.2    # Do not grow while more releases than this fail
+
+
+def _ewma(average: Optional[float], value: float) -> float:
+    return value if average is None else SMOOTHING * value + (1 - SMOOTHING) * average
+
+
+class DrainController:
+    def __init__(self, start: int = 5, min_batch: int = 1, max_batch: int = 50, failure_limit: int = 3):
+        self.batch_size = start
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.failure_limit = failure_limit
+        self.order_seconds = None       # moving average per invoice
+        self.release_seconds = None     # moving average per ZVF04 run
+        self.failure_rate = 0.0
+        self.consecutive_failures = 0
+        self.done = 0
+        self.started = time.monotonic()
+
+    def record_order(self, seconds: float):
+        self.order_seconds = _ewma(self.order_seconds, seconds)
+
+    def record_release(self, count: int, seconds: float, ok: bool):
+        self.release_seconds = _ewma(self.release_seconds, seconds)
+        self.failure_rate = _ewma(self.failure_rate, 0.0 if ok else 1.0)
+        if not ok:
+            self.consecutive_failures += 1
+            self.batch_size = max(self.min_batch, self.batch_size // 2)
+            return
+        self.consecutive_failures = 0
+        self.done += count
+        amortized = self.release_seconds / max(count, 1)
+        if (self.failure_rate <= MAX_FAILURE_RATE and self.order_seconds is not None
+                and amortized > RELEASE_SHARE * self.order_seconds):
+            self.batch_size = min(self.max_batch, self.batch_size + 1)
+
+    @property
+    def failing(self) -> bool:
+        """True when releases keep failing and the run should stop."""
+        return self.consecutive_failures >= self.failure_limit
+
+    def rate(self) -> float:
+        """Invoices released per hour so far."""
+        elapsed = time.monotonic() - self.started
+        return self.done * 3600 / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, remaining: int) -> Optional[datetime]:
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        return datetime.now() + timedelta(hours=remaining / rate)
+
+    def progress(self, remaining: int) -> str:
+        eta = self.eta(remaining)
+        eta_text = eta.strftime("%d-%m-%Y %H:%M") if eta else "ukendt"
+        order = f"{self.order_seconds:.1f}s" if self.order_seconds is not None else "-"
+        release = f"{self.release_seconds:.1f}s" if self.release_seconds is not None else "-"
+        return (f"Afvikling: {self.done} faktureret, {remaining} tilbage, {self.rate():.0f} pr. time, "
+                f"forventet færdig {eta_text} (batch {self.batch_size}, ordre {order}, frigivelse {release}, "
+                f"fejlrate {self.failure_rate:.0%})")
@@ -4,7 +4,6 @@
 # - No DB updates
 
 import os
-import csv
 import locale
 from datetime import datetime, timedelta
 import re
@@ -12,6 +11,11 @@ import math
 import time
 import pyodbc
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from verify_cpr_cvr import classify_identifier
+import checkpoint_journal
+import claim_leases
+from sap_layouts import INVOICE_HEADER, INVOICE_LINE, write_records
+from invoice_reader import fetch_claimable, fetch_invoice
 
 # ---------- Helpers ----------
 
@@ -40,131 +44,210 @@ def format_decimal(value, decimals=None):
     
     
 
-        
-def generate_invoice_csv(orchestrator_connection: OrchestratorConnection, conn: pyodbc.Connection, cursor: pyodbc.Cursor):
-    locale.setlocale(locale.LC_NUMERIC, 'da_DK')
 
-    # Fetch one fakturering row that should be invoiced
-    cursor.execute("""
-        SELECT TOP (1) *
-        FROM [VejmanKassen].[dbo].[VejmanFakturering]
-        WHERE FakturaStatus = 'Afsendt'
-    """)
-    row = cursor.fetchone()
+def is_valid_identifier(cvr_nr) -> bool:
+    """True if CvrNr is a well-formed CVR (8 digits) or CPR (10 digits)."""
+    try:
+        formatted = f'{int(cvr_nr):010}'
+    except (TypeError, ValueError):
+        return False
+    return classify_identifier(formatted) != "neither"
 
-    if row:
         
-        tilladelsestype = row.TilladelsesType
-        # Fetch the matching fakturatekster row
+def _preflight(orchestrator_connection, conn, cursor, row, journal=None, status_writer=None) -> bool:
+    """Checks before any SAP work. A rejected row gets its status (queued on status_writer if given); returns False."""
+    if not is_valid_identifier(row.CvrNr):
+        # Malformed CPR/CVR number
+        status = 'UgyldigtCprCvr'
+        orchestrator_connection.log_info(f"Faktura {row.ID}: ugyldigt CPR/CVR-nummer '{row.CvrNr}', springes over")
+    elif row.Prisafvigelse:
+        # Meter × Enhedspris × AntalDage does not add up to TotalPris
+        status = 'TilGennemsyn'
+        orchestrator_connection.log_info(
+            f"Faktura {row.ID}: beregnet beløb {row.Pris.amount} afviger fra TotalPris {row.TotalPris}, sendes til gennemsyn")
+    else:
+        return True
+
+    if status_writer is not None:
+        status_writer.set_status(row.ID, status, journal_step=checkpoint_journal.ABANDONED)
+    else:
         cursor.execute("""
             UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
-            SET FakturaStatus = 'TilFakturering'
+            SET FakturaStatus = ?
             WHERE ID = ?
-        """, row.ID)
+        """, status, row.ID)
         conn.commit()
+        if journal is not None:
+            checkpoint_journal.record_step(journal, row.ID, checkpoint_journal.ABANDONED)
+    return False
+
 
+def claim_next(orchestrator_connection: OrchestratorConnection, conn: pyodbc.Connection, cursor: pyodbc.Cursor,
+               journal=None, status_writer=None, reader=None):
+    """
+    Claim the next 'Afsendt' row that passes the pre-flight checks, without writing
+    its invoice file (see write_invoice_csv). Returns the row, or None when the queue is empty.
+    """
+    while True:
+        # Next fakturering row that should be invoiced
+        row = reader.next_row() if reader is not None else next(iter(fetch_claimable(cursor, 0, 1)), None)
+        if not row:
+            return None
+
+        claimed = claim_leases.claim_row(cursor, row.ID)
+        conn.commit()
+        if not claimed:
+            # Taken by another run since it was read
+            continue
+        if journal is not None:
+            checkpoint_journal.record_step(journal, row.ID, checkpoint_journal.CLAIMED, vejman_id=row.VejmanID)
+        if _preflight(orchestrator_connection, conn, cursor, row, journal, status_writer):
+            return row
+
+
+def generate_invoice_csv(orchestrator_connection: OrchestratorConnection, conn: pyodbc.Connection, cursor: pyodbc.Cursor,
+                         invoice_id=None, journal=None, status_writer=None, reader=None, work_dir=None):
+    """
+    Claim the next 'Afsendt' row (or, with invoice_id, re-read a row this robot
+    already claimed) and write its invoice file. Steps are recorded in the
+    checkpoint journal when one is given; rejected rows are queued on
+    status_writer (a db_writer.StatusWriter) when one is given. Candidate rows
+    come from reader (an invoice_reader.InvoiceReader) when one is given. The file
+    is written to work_dir (default: the current working directory).
+    """
+    if invoice_id is None:
+        row = claim_next(orchestrator_connection, conn, cursor, journal=journal,
+                         status_writer=status_writer, reader=reader)
+    else:
+        # Resume a row claimed by an earlier, interrupted run
+        adopted = claim_leases.adopt_row(cursor, invoice_id)
+        conn.commit()
+        row = fetch_invoice(cursor, invoice_id, 'TilFakturering') if adopted else None
+        if row and not _preflight(orchestrator_connection, conn, cursor, row, journal, status_writer):
+            row = None
+
+    if not row:
+        return False, None, None, None
+    return True, write_invoice_csv(cursor, row, journal=journal, work_dir=work_dir), row.ID, row.VejmanID
+
+
+def write_invoice_csv(cursor: pyodbc.Cursor, row, journal=None, work_dir=None) -> str:
+    """Write the invoice file for a claimed row and return its path."""
+    locale.setlocale(locale.LC_NUMERIC, 'da_DK')
+
+    
+    tilladelsestype = row.TilladelsesType
+    # The matching fakturatekster row; InvoiceReader fetches it per chunk, a resumed row looks it up
+    fakturarow = row.Fakturatekst
+    if fakturarow is None:
         cursor.execute("""
             SELECT TOP (1) *
             FROM [dbo].[VejmanFakturaTekster]
             WHERE Fakturalinje = ?
         """, (tilladelsestype,))
         fakturarow = cursor.fetchone()
-        Fakturalinje = fakturarow.Fakturalinje
-        fordringstype = fakturarow.Fordringstype
-        psp_element = fakturarow.PSPElement
-        materiale_nr_opus = fakturarow.MaterialeNrOpus
-        formatted_material_number = f'{int(materiale_nr_opus):018}'
-        top_text = fakturarow.Toptekst
-        forklaring = fakturarow.Forklaring
-
-        # Assign variables directly using column names
-        ID = row.ID
-        VejmanID = row.VejmanID
-        FørsteSted = row.FørsteSted
-        Tilladelsesnr = row.Tilladelsesnr
-        Ansøger = row.Ansøger
-        CvrNr = row.CvrNr
-        Enhedspris = row.Enhedspris
-        Meter = row.Meter
-        Startdato = (datetime.strptime(row.Startdato, '%Y-%m-%d')if row.Startdato else None)
-        Slutdato = (datetime.strptime(row.Slutdato, '%Y-%m-%d') if row.Slutdato else None)
-        AntalDage = row.AntalDage
-        TotalPris = row.TotalPris
-        kunde_ref_id = row.ATT
-
-        # Ensure specific columns have the correct types
-        Enhedspris = float(Enhedspris) if Enhedspris is not None else None
-        Meter = float(Meter) if Meter is not None else None
-        TotalPris = float(TotalPris) if TotalPris is not None else None
-        AntalDage = int(AntalDage) if AntalDage is not None else None
-        
-        
-        def format_decimal(value, decimals=None):
-            if isinstance(value, int):
+    Fakturalinje = fakturarow.Fakturalinje
+    fordringstype = fakturarow.Fordringstype
+    psp_element = fakturarow.PSPElement
+    materiale_nr_opus = fakturarow.MaterialeNrOpus
+    formatted_material_number = f'{int(materiale_nr_opus):018}'
+    top_text = fakturarow.Toptekst
+    forklaring = fakturarow.Forklaring
+
+    # Assign variables directly using column names
+    ID = row.ID
+    VejmanID = row.VejmanID
+    FørsteSted = row.FørsteSted
+    Tilladelsesnr = row.Tilladelsesnr
+    Ansøger = row.Ansøger
+    CvrNr = row.CvrNr
+    Enhedspris = row.Enhedspris
+    Meter = row.Meter
+    Startdato = row.Startdato
+    Slutdato = row.Slutdato
+    AntalDage = row.AntalDage
+    TotalPris = row.TotalPris
+    kunde_ref_id = row.ATT
+
+    # Ensure specific columns have the correct types
+    Enhedspris = float(Enhedspris) if Enhedspris is not None else None
+    Meter = float(Meter) if Meter is not None else None
+    TotalPris = float(TotalPris) if TotalPris is not None else None
+    AntalDage = int(AntalDage) if AntalDage is not None else None
+    
+    
+    def format_decimal(value, decimals=None):
+        if isinstance(value, int):
+            if decimals is None:
+                # Format the integer without decimal places
+                return str(locale.format_string("%d", value, grouping=False))
+            else:
+                # Force formatting with the specified number of decimals
+                return str(locale.format_string(f"%.{decimals}f", value, grouping=False))
+        elif isinstance(value, float):
+            # Check if the value is a whole number and decimals is None (e.g., 19.0 should be formatted as 19)
+            if value.is_integer() and decimals is None:
+                return str(locale.format_string("%d", int(value), grouping=False))
+            else:
+                # Format the float with the specified number of decimal places
                 if decimals is None:
-                    # Format the integer without decimal places
-                    return str(locale.format_string("%d", value, grouping=False))
+                    return str(locale.format_string("%.2f", value, grouping=False))
                 else:
                     # Force formatting with the specified number of decimals
                     return str(locale.format_string(f"%.{decimals}f", value, grouping=False))
-            elif isinstance(value, float):
-                # Check if the value is a whole number and decimals is None (e.g., 19.0 should be formatted as 19)
-                if value.is_integer() and decimals is None:
-                    return str(locale.format_string("%d", int(value), grouping=False))
-                else:
-                    # Format the float with the specified number of decimal places
-                    if decimals is None:
-                        return str(locale.format_string("%.2f", value, grouping=False))
-                    else:
-                        # Force formatting with the specified number of decimals
-                        return str(locale.format_string(f"%.{decimals}f", value, grouping=False))
-            else:
-                # If it's not a number, return the original value
-                return str(value)
+        else:
+            # If it's not a number, return the original value
+            return str(value)
 
-        
-        formatted_cvr_number = f'{int(CvrNr):010}'
-        
-        
-        today = datetime.now().strftime('%d-%m-%Y')
-        future_date = (datetime.now() + timedelta(days=30)).strftime('%d-%m-%Y')        
-        short_start_date = Startdato.strftime('%d-%m-%Y')
-        short_end_date = Slutdato.strftime('%d-%m-%Y')
-        
-        # Format numbers inside the f-string expressions
-        opus_price = format_decimal(round(Meter*Enhedspris,2),2)
-        unit_price = format_decimal(Enhedspris)
-        length = format_decimal(Meter)
-        days_period_formatted = format_decimal(AntalDage,3)
-        total_calculated_price = format_decimal(TotalPris)
-            # Use eval to evaluate them as f-strings
-        top_text_evaluated = eval(top_text)
-        forklaring_evaluated = eval(forklaring)
-        
-        # Prepare rows for writing
-        row_H = [
-            'H', formatted_cvr_number, '', today, today, '0020', '20', '20', 'ZRA', Tilladelsesnr, '', 
-            '', '', '', kunde_ref_id, 
-            top_text_evaluated,
-            '', '', '', '', '', '', '', short_start_date, short_start_date, short_end_date, '', '', short_start_date, short_end_date, '', fordringstype, '', '', short_start_date, future_date
-        ]
-        
-        row_L = [
-            'L', formatted_material_number, Fakturalinje, days_period_formatted, opus_price, 'NEJ', psp_element, '', '', '', 
-            '', forklaring_evaluated,
-            '', '', '', '', '', '', '', '', '','', '', '', '', '', '', '', '', '', '', '', '', '', '', ''
-        ]
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")[:-3]  # milliseconds
-        csvname = f"{timestamp}_Fakturaer_{ID}.csv"
+    
+    formatted_cvr_number = f'{int(CvrNr):010}'
+    
+    
+    today = datetime.now().strftime('%d-%m-%Y')
+    future_date = (datetime.now() + timedelta(days=30)).strftime('%d-%m-%Y')        
+    short_start_date = Startdato.strftime('%d-%m-%Y')
+    short_end_date = Slutdato.strftime('%d-%m-%Y')
+    
+    # Format numbers inside the f-string expressions
+    opus_price = format_decimal(float(row.Pris.unit_price), 2)  # Exact øre rounding, see pricing.py
+    unit_price = format_decimal(Enhedspris)
+    length = format_decimal(Meter)
+    days_period_formatted = format_decimal(AntalDage,3)
+    total_calculated_price = format_decimal(TotalPris)
+        # Use eval to evaluate them as f-strings
+    top_text_evaluated = eval(top_text)
+    forklaring_evaluated = eval(forklaring)
+    
+    # Records for the H and L layouts in sap_layouts
+    record_H = {
+        "kundenummer": formatted_cvr_number,
+        "fakturadato": today,
+        "bogfoeringsdato": today,
+        "tilladelsesnr": Tilladelsesnr,
+        "kunde_ref_id": kunde_ref_id,
+        "toptekst": top_text_evaluated,
+        "startdato": short_start_date,
+        "slutdato": short_end_date,
+        "fordringstype": fordringstype,
+        "forfaldsdato": future_date,
+    }
+    
+    record_L = {
+        "materialenummer": formatted_material_number,
+        "fakturalinje": Fakturalinje,
+        "antal": days_period_formatted,
+        "pris": opus_price,
+        "psp_element": psp_element,
+        "forklaring": forklaring_evaluated,
+    }
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")[:-3]  # milliseconds
+    csvname = f"{timestamp}_Fakturaer_{ID}.csv"
 
-        full_path = os.path.abspath(csvname)  # get absolute path in current working dir
+    full_path = os.path.abspath(os.path.join(work_dir or os.getcwd(), csvname))
 
-        
-        # Write to the CSV
-        with open(full_path, mode='a', newline='', encoding='windows-1252') as file:
-            writer = csv.writer(file, delimiter=';')
-            writer.writerow(row_H)
-            writer.writerow(row_L)
-        return True, full_path, ID, VejmanID
-
-    return False, None, None, None
+    
+    # Write to the CSV
+    write_records(full_path, [(INVOICE_HEADER, record_H), (INVOICE_LINE, record_L)], encoding='windows-1252')
+    if journal is not None:
+        checkpoint_journal.record_step(journal, ID, checkpoint_journal.CSV_WRITTEN, vejman_id=VejmanID, csv_path=full_path)
+    return full_path
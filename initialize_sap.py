@@ -1,19 +1,14 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException
-from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 import random
 import string
 import time
-import psutil
 import os
 import win32com.client
 
+# selenium and psutil are imported inside initialize_sap: a run that finds an
+# open SAP session skips the browser login and never loads them.
 
-def download_sap(driver: webdriver.Chrome, downloads_folder, orchestrator_connection, parent_tab): 
+
+def download_sap(driver, downloads_folder, orchestrator_connection, parent_tab): 
     before = set(os.listdir(downloads_folder))
     driver.execute_script("arguments[0].click();", parent_tab)
     
@@ -35,7 +30,33 @@ def download_sap(driver: webdriver.Chrome, downloads_folder, orchestrator_connec
 
     
     
-def initialize_sap(orchestrator_connection: OrchestratorConnection):
+def existing_session():
+    """The open SAP GUI session, or None if SAP is not running or not logged in."""
+    try:
+        application = win32com.client.GetObject("SAPGUI").GetScriptingEngine
+        if application.Children.Count > 0:
+            connection = application.Children(0)
+            if connection.Children.Count > 0:
+                session = connection.Children(0)
+                if session.Info.User:
+                    return session
+    except Exception:
+        pass
+    return None
+
+
+def initialize_sap(orchestrator_connection):
+    if existing_session() is not None:
+        orchestrator_connection.log_info("SAP-session er allerede åben, springer browserlogin over")
+        return True
+
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.chrome.options import Options
+    import psutil
+
     # Opus bruger
     OpusLogin = orchestrator_connection.get_credential("OpusBruger")
     OpusUser = OpusLogin.username
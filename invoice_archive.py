@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import date
+
+# Content-addressed archive for generated invoice and debitor files.
+# Files are stored gzip-compressed under their SHA-256 in <root>/objects/xx/,
+# with a SQLite index keyed by invoice ID (plus date and order number).
+# Working files are written to a per-run directory under <root>/work and
+# removed once their invoice is committed and archived.
+
+# Next to the code, not the working directory, so every entry point finds the same archive
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arkiv")
+
+KIND_FAKTURA = "faktura"
+KIND_DEBITOR = "debitor"
+
+
+def open_archive(root: str = ARCHIVE_DIR) -> sqlite3.Connection:
+    os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+    index = sqlite3.connect(os.path.join(root, "index.sqlite3"))
+    index.row_factory = sqlite3.Row
+    index.execute("""
+        CREATE TABLE IF NOT EXISTS files (
+            sha256         TEXT NOT NULL,
+            kind           TEXT NOT NULL,
+            invoice_id     INTEGER NOT NULL,
+            ordernumber    TEXT,
+            archived_date  TEXT NOT NULL,
+            original_name  TEXT NOT NULL,
+            PRIMARY KEY (invoice_id, kind, sha256)
+        )
+    """)
+    index.execute("CREATE INDEX IF NOT EXISTS files_date ON files (archived_date)")
+    index.execute("CREATE INDEX IF NOT EXISTS files_ordernumber ON files (ordernumber)")
+    index.commit()
+    return index
+
+
+def _root(index: sqlite3.Connection) -> str:
+    return os.path.dirname(index.execute("PRAGMA database_list").fetchone()["file"])
+
+
+def object_path(root: str, sha256: str) -> str:
+    return os.path.join(root, "objects", sha256[:2], sha256 + ".gz")
+
+
+def archive_file(index: sqlite3.Connection, path: str, kind: str, invoice_id, ordernumber=None) -> str:
+    """Store a file (once per content) and index it under the invoice. Returns its SHA-256."""
+    with open(path, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    target = object_path(_root(index), sha256)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + ".tmp"
+        with gzip.open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+    index.execute("""
+        INSERT OR REPLACE INTO files (sha256, kind, invoice_id, ordernumber, archived_date, original_name)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (sha256, kind, invoice_id, ordernumber, date.today().isoformat(), os.path.basename(path)))
+    index.commit()
+    return sha256
+
+
+def lookup(index: sqlite3.Connection, invoice_id):
+    """Archived files for an invoice."""
+    return index.execute("SELECT * FROM files WHERE invoice_id = ? ORDER BY kind", (invoice_id,)).fetchall()
+
+
+def iter_files(index: sqlite3.Connection, kind: str):
+    return index.execute("SELECT * FROM files WHERE kind = ? ORDER BY original_name", (kind,))
+
+
+def read_file(index: sqlite3.Connection, sha256: str) -> bytes:
+    with gzip.open(object_path(_root(index), sha256), "rb") as f:
+        return f.read()
+
+
+# ---------- Working directories ----------
+
+def new_run_dir(root: str = ARCHIVE_DIR) -> str:
+    work = os.path.join(root, "work")
+    os.makedirs(work, exist_ok=True)
+    return tempfile.mkdtemp(prefix="run_", dir=work)
+
+
+def remove_stale_run_dirs(keep_paths, root: str = ARCHIVE_DIR):
+    """Delete run directories from earlier runs that hold none of keep_paths (files still in flight)."""
+    work = os.path.join(root, "work")
+    if not os.path.isdir(work):
+        return
+    keep_dirs = {os.path.dirname(os.path.abspath(p)) for p in keep_paths if p}
+    for entry in os.scandir(work):
+        if entry.is_dir() and os.path.abspath(entry.path) not in keep_dirs:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def archive_and_remove(index: sqlite3.Connection, files, invoice_id, ordernumber=None):
+    """Archive an invoice's working files [(path, kind), ...] and delete them."""
+    for path, kind in files:
+        if path and os.path.exists(path):
+            archive_file(index, path, kind, invoice_id, ordernumber)
+            os.remove(path)
@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import pyodbc
+from pricing import LinePrice, price_rows
+from scheduler import known_customers, schedule
+
+# Only the columns generate_invoice_csv uses, converted to proper types in SQL
+_COLUMNS = """
+    ID, VejmanID, FørsteSted, Tilladelsesnr, Ansøger, CvrNr,
+    TRY_CONVERT(decimal(18, 4), Enhedspris) AS Enhedspris,
+    TRY_CONVERT(decimal(18, 4), Meter)      AS Meter,
+    TRY_CONVERT(date, Startdato)            AS Startdato,
+    TRY_CONVERT(date, Slutdato)             AS Slutdato,
+    TRY_CONVERT(int, AntalDage)             AS AntalDage,
+    TRY_CONVERT(decimal(18, 2), TotalPris)  AS TotalPris,
+    ATT, TilladelsesType
+"""
+
+
+@dataclass(slots=True)
+class InvoiceRow:
+    ID: int
+    VejmanID: Optional[str]
+    FørsteSted: Optional[str]
+    Tilladelsesnr: Optional[str]
+    Ansøger: Optional[str]
+    CvrNr: Optional[str]
+    Enhedspris: Optional[Decimal]
+    Meter: Optional[Decimal]
+    Startdato: Optional[date]
+    Slutdato: Optional[date]
+    AntalDage: Optional[int]
+    TotalPris: Optional[Decimal]
+    ATT: Optional[str]
+    TilladelsesType: Optional[str]
+    # Set by pricing.price_rows
+    Pris: Optional[LinePrice] = None
+    Prisafvigelse: bool = False
+    # VejmanFakturaTekster row for TilladelsesType, set per chunk by InvoiceReader
+    Fakturatekst: Optional[object] = None
+
+
+def _to_row(r) -> InvoiceRow:
+    return InvoiceRow(*r)
+
+
+def fetch_invoice(cursor: pyodbc.Cursor, invoice_id, status: str) -> Optional[InvoiceRow]:
+    """One row by ID, only if it still has the given FakturaStatus."""
+    cursor.execute(f"""
+        SELECT {_COLUMNS}
+        FROM [VejmanKassen].[dbo].[VejmanFakturering]
+        WHERE ID = ? AND FakturaStatus = ?
+    """, invoice_id, status)
+    r = cursor.fetchone()
+    if not r:
+        return None
+    row = _to_row(r)
+    price_rows([row])
+    return row
+
+
+def fetch_claimable(cursor: pyodbc.Cursor, after_id: int, count: int):
+    """Up to count 'Afsendt' rows with ID > after_id, in ID order, priced as one batch."""
+    cursor.execute(f"""
+        SELECT TOP (?) {_COLUMNS}
+        FROM [VejmanKassen].[dbo].[VejmanFakturering]
+        WHERE FakturaStatus = 'Afsendt' AND ID > ?
+        ORDER BY ID
+    """, count, after_id)
+    rows = [_to_row(r) for r in cursor.fetchmany(count)]
+    price_rows(rows)
+    return rows
+
+
+def fetch_fakturatekster(cursor: pyodbc.Cursor, tilladelsestyper) -> dict:
+    """The VejmanFakturaTekster row for each of tilladelsestyper, in one query: {Fakturalinje: row}."""
+    types = sorted({t for t in tilladelsestyper if t is not None})
+    if not types:
+        return {}
+    placeholders = ", ".join("?" for _ in types)
+    cursor.execute(f"""
+        SELECT *
+        FROM [dbo].[VejmanFakturaTekster]
+        WHERE Fakturalinje IN ({placeholders})
+    """, *types)
+    tekster = {}
+    for r in cursor.fetchall():
+        tekster.setdefault(r.Fakturalinje, r)  # First match, like TOP (1)
+    return tekster
+
+
+def count_backlog(cursor: pyodbc.Cursor) -> int:
+    """Number of rows still waiting in 'Afsendt'."""
+    cursor.execute("""
+        SELECT COUNT(*)
+        FROM [VejmanKassen].[dbo].[VejmanFakturering]
+        WHERE FakturaStatus = 'Afsendt'
+    """)
+    return cursor.fetchone()[0]
+
+
+class InvoiceReader:
+    """
+    Hands out claimable VejmanFakturering rows one at a time. The next chunk is
+    fetched on a background thread (with its own connection) while the current
+    chunk is being processed in SAP, and ordered by scheduler.schedule; the chunk's
+    VejmanFakturaTekster rows come along in one query. Rows are only candidates: the caller still
+    has to claim them, since another run may have taken them in the meantime.
+    """
+
+    def __init__(self, conn_string: str, chunk_size: int = 25, lane: str = "fifo"):
+        self.conn_string = conn_string
+        self.chunk_size = chunk_size
+        self.lane = lane
+        self._buffer = []
+        self._last_id = 0
+        self._pending = None
+        self._conn = None
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="invoice-prefetch")
+
+    def _fetch(self, after_id: int, count: int):
+        # pyodbc connections must not be shared across threads; this one lives on the worker
+        if self._conn is None:
+            self._conn = pyodbc.connect(self.conn_string)
+        try:
+            cursor = self._conn.cursor()
+            rows = fetch_claimable(cursor, after_id, count)
+            if rows:
+                rows = schedule(rows, known_customers(cursor, rows), self.lane)
+                # One lookup per TilladelsesType in the chunk instead of one per invoice
+                tekster = fetch_fakturatekster(cursor, (row.TilladelsesType for row in rows))
+                for row in rows:
+                    row.Fakturatekst = tekster.get(row.TilladelsesType)
+        except pyodbc.Error:
+            # Drop the connection; the next fetch reconnects
+            try:
+                self._conn.close()
+            except pyodbc.Error:
+                pass
+            self._conn = None
+            raise
+        return rows
+
+    def _prefetch(self):
+        if self._pending is None:
+            self._pending = self._pool.submit(self._fetch, self._last_id, self.chunk_size)
+
+    def _take_pending(self):
+        self._prefetch()
+        rows, self._pending = self._pending.result(), None
+        if rows:
+            self._last_id = max(row.ID for row in rows)
+        return rows
+
+    def next_row(self) -> Optional[InvoiceRow]:
+        if not self._buffer:
+            self._buffer = self._take_pending()
+            if not self._buffer and self._last_id:
+                # End of the queue: rescan once from the start for rows returned to 'Afsendt'
+                self._last_id = 0
+                self._buffer = self._take_pending()
+            if not self._buffer:
+                return None
+            self._buffer.reverse()  # pop() from the end in scheduled order
+            self._prefetch()
+        return self._buffer.pop()
+
+    def close(self):
+        self._pool.submit(self._close_conn).result()
+        self._pool.shutdown(wait=True)
+
+    def _close_conn(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
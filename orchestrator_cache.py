@@ -0,0 +1,53 @@
+import time
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+
+class CachedOrchestratorConnection:
+    """
+    Run-scoped cache in front of OrchestratorConnection for get_constant and
+    get_credential. Entries live for ttl seconds; update_credential invalidates
+    the credential it rotates. Everything else is passed straight through.
+    """
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection, ttl: float = 900.0):
+        self._conn = orchestrator_connection
+        self.ttl = ttl
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # log_info, log_error, etc.
+        return getattr(self._conn, name)
+
+    def _get(self, key, load):
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = load()
+        self._cache[key] = (now + self.ttl, value)
+        return value
+
+    def get_constant(self, constant_name: str):
+        return self._get(("constant", constant_name), lambda: self._conn.get_constant(constant_name))
+
+    def get_credential(self, credential_name: str):
+        return self._get(("credential", credential_name), lambda: self._conn.get_credential(credential_name))
+
+    def update_credential(self, credential_name: str, username: str, password: str):
+        result = self._conn.update_credential(credential_name, username, password)
+        # Only after the write, so a concurrent get cannot re-cache the old value
+        self.invalidate_credential(credential_name)
+        return result
+
+    def invalidate_credential(self, credential_name: str):
+        self._cache.pop(("credential", credential_name), None)
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def stats(self) -> str:
+        return f"Orchestrator-cache: {self.hits} hits, {self.misses} misses"
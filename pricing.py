@@ -0,0 +1,52 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable, NamedTuple, Optional
+
+# Allowed difference between the invoiced amount and Vejman's TotalPris, on top of
+# the rounding slack from pricing the line at 2 decimals (0.005 per day).
+PRICE_TOLERANCE = Decimal("0.01")
+
+CENT = Decimal("0.01")
+HALF_CENT = Decimal("0.005")
+
+
+class LinePrice(NamedTuple):
+    unit_price: Optional[Decimal]     # Meter × Enhedspris, rounded half-up to øre (the L-line price)
+    amount: Optional[Decimal]         # AntalDage × unit_price
+    difference: Optional[Decimal]     # amount - TotalPris
+    mismatch: bool
+
+
+def _decimal(value) -> Optional[Decimal]:
+    if value is None:
+        return None
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def price_line(meter, enhedspris, antal_dage, total_pris, tolerance: Decimal = PRICE_TOLERANCE) -> LinePrice:
+    meter, enhedspris, antal_dage, total_pris = map(_decimal, (meter, enhedspris, antal_dage, total_pris))
+    if meter is None or enhedspris is None:
+        return LinePrice(None, None, None, True)
+    unit_price = (meter * enhedspris).quantize(CENT, rounding=ROUND_HALF_UP)
+    if antal_dage is None:
+        return LinePrice(unit_price, None, None, True)
+    amount = (antal_dage * unit_price).quantize(CENT, rounding=ROUND_HALF_UP)
+    if total_pris is None:
+        return LinePrice(unit_price, amount, None, False)
+    difference = amount - total_pris
+    mismatch = abs(difference) > tolerance + HALF_CENT * abs(antal_dage)
+    return LinePrice(unit_price, amount, difference, mismatch)
+
+
+def price_rows(rows: Iterable, tolerance: Decimal = PRICE_TOLERANCE):
+    """
+    Price a batch of invoice rows (invoice_reader.InvoiceRow) in one pass.
+    Sets row.Pris and row.Prisafvigelse and returns the rows that need review.
+    """
+    review = []
+    for row in rows:
+        line = price_line(row.Meter, row.Enhedspris, row.AntalDage, row.TotalPris, tolerance)
+        row.Pris = line
+        row.Prisafvigelse = line.mismatch
+        if line.mismatch:
+            review.append(row)
+    return review
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import json
+import os
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from pricing import price_line
+
+# End-of-day reconciliation between VejmanFakturering and the ZVF04 billing results.
+# send_invoice passes the rows of the ZVF04 result table to a sink. The run stages them
+# with a ReleasedSink in VejmanZVF04Raekker, next to VejmanFakturering, so the rows of
+# every robot are in one place, and commits them once the release has succeeded. reconcile() loads the day's Faktureret rows and the
+# day's ZVF04 rows in bulk and hash-joins them on (order number, amount).
+# Whatever does not match is reported as:
+#   MANGLER_I_SAP     Faktureret in the DB, no ZVF04 row with that order number
+#   MANGLER_I_DB      ZVF04 row whose order number is not Faktureret in the DB that day
+#   BELOEBSAFVIGELSE  same order number on both sides, different amounts
+
+# ZVF04 column headers holding the order number and the net amount (first match wins)
+ORDER_HEADERS = ("Salgsdokument", "Salgsdok.", "Ordre", "Ref.dok.")
+AMOUNT_HEADERS = ("Nettoværdi", "Nettov.", "Beløb")
+
+MISSING_IN_SAP = "MANGLER_I_SAP"
+MISSING_IN_DB = "MANGLER_I_DB"
+AMOUNT_MISMATCH = "BELOEBSAFVIGELSE"
+
+RESULT_FIELDS = ["afvigelse", "invoice_id", "ordernumber", "db_amount", "sap_amount", "sap_row"]
+
+
+# ---------- ZVF04 rows ----------
+
+def ensure_released_table(conn):
+    """VejmanZVF04Raekker holds the ZVF04 result rows of every robot, one JSON row per line."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        IF OBJECT_ID('dbo.VejmanZVF04Raekker', 'U') IS NULL
+            CREATE TABLE [VejmanKassen].[dbo].[VejmanZVF04Raekker] (
+                ReleasedDate date          NOT NULL,
+                ReleasedAt   datetime2     NOT NULL,
+                RobotId      nvarchar(100) NOT NULL,
+                RowJson      nvarchar(max) NOT NULL,
+                INDEX IX_VejmanZVF04Raekker_ReleasedDate (ReleasedDate)
+            )
+    """)
+    conn.commit()
+
+
+class ReleasedSink:
+    """
+    Sink for send_invoice that stages the rows of one ZVF04 release in VejmanZVF04Raekker,
+    CHUNK rows per executemany, without committing. commit() makes them visible;
+    rollback() drops them if the release failed. A failed write does not fail the
+    release (SAP has already acted): staging stops, and commit() reports the error.
+    """
+
+    CHUNK = 500
+
+    def __init__(self, conn):
+        import claim_leases
+        self.conn = conn
+        self.owner = claim_leases.OWNER
+        self.count = 0
+        self.error = None
+        self._rows = []
+
+    def __call__(self, record):
+        if self.error is not None:
+            return
+        self._rows.append((self.owner, json.dumps(dict(record), ensure_ascii=False)))
+        self.count += 1
+        if len(self._rows) >= self.CHUNK:
+            self._write()
+
+    def _write(self):
+        rows, self._rows = self._rows, []
+        if not rows or self.error is not None:
+            return
+        try:
+            cursor = self.conn.cursor()
+            cursor.fast_executemany = True
+            cursor.executemany("""
+                INSERT INTO [VejmanKassen].[dbo].[VejmanZVF04Raekker] (ReleasedDate, ReleasedAt, RobotId, RowJson)
+                VALUES (CAST(GETDATE() AS date), SYSDATETIME(), ?, ?)
+            """, rows)
+        except Exception as e:
+            self.error = e
+
+    def commit(self):
+        """Commit the staged rows. Returns the write error (rows rolled back), or None."""
+        self._write()
+        if self.error is None:
+            try:
+                self.conn.commit()
+                return None
+            except Exception as e:
+                self.error = e
+        self.rollback()
+        return self.error
+
+    def rollback(self):
+        self._rows = []
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+
+
+def record_released(conn, records):
+    """Store the rows of one ZVF04 release ({header: value} each) under today's date, in one transaction."""
+    sink = ReleasedSink(conn)
+    for record in records:
+        sink(record)
+    error = sink.commit()
+    if error is not None:
+        raise error
+
+
+def load_released(cursor, day: date):
+    """The ZVF04 rows released on day, by any robot."""
+    cursor.execute("SELECT RowJson FROM [VejmanKassen].[dbo].[VejmanZVF04Raekker] WHERE ReleasedDate = ?", day)
+    return [json.loads(r.RowJson) for r in cursor.fetchall()]
+
+
+def _column(rows, candidates):
+    headers = rows[0].keys() if rows else ()
+    for name in candidates:
+        if name in headers:
+            return name
+    raise RuntimeError(f"Ingen af kolonnerne {candidates} findes i ZVF04-tabellen (kolonner: {list(headers)})")
+
+
+def normalize_ordernumber(value) -> str:
+    return str(value or "").strip().lstrip("0")
+
+
+def parse_amount(text) -> Decimal | None:
+    """SAP list amount ('1.234,56', '1.234,56-') as Decimal."""
+    text = str(text or "").strip()
+    if not text:
+        return None
+    negative = text.endswith("-")
+    text = text.rstrip("-").replace(".", "").replace(",", ".")
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        return None
+    return -amount if negative else amount
+
+
+# ---------- DB rows ----------
+
+def fetch_invoiced(cursor, day: date):
+    """The day's Faktureret rows as (ID, order number, invoiced amount), in one query."""
+    cursor.execute("""
+        SELECT ID, Ordrenummer,
+               TRY_CONVERT(decimal(18, 4), Meter)      AS Meter,
+               TRY_CONVERT(decimal(18, 4), Enhedspris) AS Enhedspris,
+               TRY_CONVERT(int, AntalDage)             AS AntalDage,
+               TRY_CONVERT(decimal(18, 2), TotalPris)  AS TotalPris
+        FROM [VejmanKassen].[dbo].[VejmanFakturering]
+        WHERE FakturaStatus = 'Faktureret' AND FakturaDato = ?
+    """, day)
+    result = []
+    for r in cursor.fetchall():
+        line = price_line(r.Meter, r.Enhedspris, r.AntalDage, r.TotalPris)
+        amount = line.amount if line.amount is not None else r.TotalPris
+        result.append((r.ID, normalize_ordernumber(r.Ordrenummer), amount))
+    return result
+
+
+# ---------- Join ----------
+
+def reconcile(db_rows, sap_rows):
+    """
+    db_rows: [(invoice_id, ordernumber, amount)], sap_rows: [{header: value}].
+    Returns the discrepancies as dicts with RESULT_FIELDS.
+    """
+    if sap_rows:
+        order_col = _column(sap_rows, ORDER_HEADERS)
+        amount_col = _column(sap_rows, AMOUNT_HEADERS)
+
+    # Build side: ZVF04 rows keyed by (order number, amount)
+    sap_by_key = {}
+    for r in sap_rows:
+        key = (normalize_ordernumber(r[order_col]), parse_amount(r[amount_col]))
+        sap_by_key.setdefault(key, []).append(r)
+
+    # Probe side: DB rows; exact matches consume a ZVF04 row
+    db_unmatched = []
+    for invoice_id, ordernumber, amount in db_rows:
+        bucket = sap_by_key.get((ordernumber, amount))
+        if bucket:
+            bucket.pop()
+        else:
+            db_unmatched.append((invoice_id, ordernumber, amount))
+
+    # Second join on order number alone separates amount mismatches from orphans
+    sap_by_order = {}
+    for (ordernumber, amount), bucket in sap_by_key.items():
+        for r in bucket:
+            sap_by_order.setdefault(ordernumber, []).append((amount, r))
+
+    findings = []
+    for invoice_id, ordernumber, amount in db_unmatched:
+        bucket = sap_by_order.get(ordernumber)
+        if bucket:
+            sap_amount, r = bucket.pop()
+            findings.append(_finding(AMOUNT_MISMATCH, invoice_id, ordernumber, amount, sap_amount, r))
+        else:
+            findings.append(_finding(MISSING_IN_SAP, invoice_id, ordernumber, amount, None, None))
+    for ordernumber, bucket in sap_by_order.items():
+        for sap_amount, r in bucket:
+            findings.append(_finding(MISSING_IN_DB, None, ordernumber, None, sap_amount, r))
+    return findings
+
+
+def _finding(kind, invoice_id, ordernumber, db_amount, sap_amount, sap_row):
+    return {
+        "afvigelse": kind,
+        "invoice_id": invoice_id,
+        "ordernumber": ordernumber,
+        "db_amount": db_amount,
+        "sap_amount": sap_amount,
+        "sap_row": json.dumps(sap_row, ensure_ascii=False) if sap_row else "",
+    }
+
+
+def write_findings(path, findings):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(findings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile the day's Faktureret rows against the ZVF04 results.")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today(), help="YYYY-MM-DD, default today.")
+    parser.add_argument("--out", default=None, help="Result file, default afstemning_<date>.csv.")
+    args = parser.parse_args(argv)
+
+    import pyodbc
+    from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+    orchestrator_connection = OrchestratorConnection("VejmanKassenSAP", os.getenv('OpenOrchestratorSQL'),
+                                                     os.getenv('OpenOrchestratorKey'), None)
+    sql_server = orchestrator_connection.get_constant("SqlServer").value
+    conn = pyodbc.connect("DRIVER={SQL Server};" + f"SERVER={sql_server};DATABASE=VejmanKassen;Trusted_Connection=yes;")
+    try:
+        ensure_released_table(conn)
+        db_rows = fetch_invoiced(conn.cursor(), args.date)
+        sap_rows = load_released(conn.cursor(), args.date)
+    finally:
+        conn.close()
+
+    findings = reconcile(db_rows, sap_rows)
+    out = args.out or f"afstemning_{args.date.isoformat()}.csv"
+    write_findings(out, findings)
+    summary = (f"Afstemning {args.date}: {len(db_rows)} fakturerede rækker, {len(sap_rows)} ZVF04-rækker, "
+               f"{len(findings)} afvigelser. Skrevet til {out}")
+    print(summary)
+    orchestrator_connection.log_info(summary)
+    return 1 if findings else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,68 +1,430 @@
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 import os
 import pyodbc
+import pywintypes
 
-from initialize_sap import initialize_sap
+from initialize_sap import initialize_sap, existing_session
 from create_invoices import run_zfi_fakturagrundlag, generate_csv, create_debitors
-from generate_invoice_csv import generate_invoice_csv
+from generate_invoice_csv import generate_invoice_csv, claim_next, write_invoice_csv
 from send_invoices import send_invoice
-from update_vejman import update_case
+import requests
+import update_vejman
+from update_vejman import update_case, CaseCache
 from datetime import datetime
+import checkpoint_journal as cj
+from db_writer import StatusWriter, ensure_error_column, FAILED
+from invoice_reader import InvoiceReader
+import claim_leases
+from orchestrator_cache import CachedOrchestratorConnection
+import invoice_archive
+import reconcile
+import zfi_validator
+import sap_navigation
+import argparse
+import time
+from drain import DrainController
+from invoice_reader import count_backlog
+from collections import deque
 
-#HUSK AT INSTALLERE PIP-SYSTEM-CERTS
-orchestrator_connection = OrchestratorConnection("VejmanKassenSAP", os.getenv('OpenOrchestratorSQL'),os.getenv('OpenOrchestratorKey'), None)
-sql_server = orchestrator_connection.get_constant("SqlServer").value
-conn_string = "DRIVER={SQL Server};"+f"SERVER={sql_server};DATABASE=VejmanKassen;Trusted_Connection=yes;"
-conn = pyodbc.connect(conn_string)
-cursor = conn.cursor()
-
-vejmantoken = orchestrator_connection.get_credential("VejmanToken").password
-sap_running = initialize_sap(orchestrator_connection)
-
-if not sap_running:
-        raise Exception("SAP failed to launch succesfully")
-
-while True:
-    rowexists, fakturafil, id, vejmanid = generate_invoice_csv(orchestrator_connection, conn, cursor)
-    ordernumber = None
-    
-    if not rowexists:
-        break
-    
-    if rowexists:
-        success, debitorsororder = run_zfi_fakturagrundlag(fakturafil)
-        # Output file name based on date
-        if not success:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # remove last 3 digits → milliseconds
-            filename = f"{id}_Debitorer_CSV_{timestamp}.csv"
-            debitor_csv = generate_csv(debitorsororder, filename)
-            create_debitors(debitor_csv)
-            #os.remove(debitor_csv)
-            success, debitorsororder = run_zfi_fakturagrundlag(fakturafil)
-        if success:
-            if len(debitorsororder) == 1:
-                        ordernumber = debitorsororder[0]  # Extract the only item
+# Daemon mode: idle polling interval, doubled after each empty poll
+POLL_MIN_SECONDS = 2
+POLL_MAX_SECONDS = 60
+
+# Stop the run when more than this share of the last SYSTEMIC_WINDOW invoices failed
+# (at least SYSTEMIC_MIN_ROWS of them): then the problem is SAP or the setup, not the rows.
+SYSTEMIC_WINDOW = 20
+SYSTEMIC_MIN_ROWS = 5
+SYSTEMIC_FAILURE_SHARE = 0.5
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fakturér Afsendt-rækker i VejmanFakturering gennem SAP.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Kør vedvarende: hold forbindelserne åbne og hent nye rækker, så snart de kommer.")
+    parser.add_argument("--drain", action="store_true",
+                        help="Afvikl en stor kø: frigiv ordrer i ZVF04 i batches af tilpasset størrelse og log fremdrift.")
+    args = parser.parse_args(argv)
+
+    #HUSK AT INSTALLERE PIP-SYSTEM-CERTS
+    orchestrator_connection = CachedOrchestratorConnection(
+        OrchestratorConnection("VejmanKassenSAP", os.getenv('OpenOrchestratorSQL'),os.getenv('OpenOrchestratorKey'), None))
+    sql_server = orchestrator_connection.get_constant("SqlServer").value
+    conn_string = "DRIVER={SQL Server};"+f"SERVER={sql_server};DATABASE=VejmanKassen;Trusted_Connection=yes;"
+    conn = pyodbc.connect(conn_string)
+    cursor = conn.cursor()
+
+    vejmantoken = orchestrator_connection.get_credential("VejmanToken").password
+    case_cache = CaseCache(vejmantoken)
+    journal = cj.open_journal()
+    status_writer = StatusWriter(conn, journal)
+    reader = InvoiceReader(conn_string, lane=os.getenv("VejmanKassenLane") or "fifo")  # fifo, due or amount
+    claim_leases.ensure_lease_columns(conn)
+    ensure_error_column(conn)
+    reconcile.ensure_released_table(conn)
+    lease_keeper = claim_leases.LeaseKeeper(conn_string, orchestrator_connection).start()
+    archive = invoice_archive.open_archive()
+    invoice_archive.remove_stale_run_dirs(entry["csv_path"] for entry in cj.in_flight(journal))
+    run_dir = invoice_archive.new_run_dir()
+    sap_running = initialize_sap(orchestrator_connection)
+
+    if not sap_running:
+            raise Exception("SAP failed to launch succesfully")
+
+
+    working_files = {}  # invoice id -> [(path, kind)] written so far, archived by quarantine()
+
+    def process_invoice(id, vejmanid, step, fakturafil=None, ordernumber=None, row=None):
+        """
+        Order one claimed invoice in SAP, starting after the given journal step. row is
+        the freshly claimed row, whose invoice file is then written here.
+        Returns (id, vejmanid, step, ordernumber, files) for release(), or None if the invoice was dropped.
+        """
+        if step == cj.TEST_OK:
+            # The update run may or may not have posted the Standardordre; re-running could post it twice
+            orchestrator_connection.log_error(
+                f"Faktura {id}: kørsel afbrudt under ZFI_FAKTURAGRUNDLAG-opdatering, kræver manuel kontrol")
+            return
+
+        files = working_files[id] = [(fakturafil, invoice_archive.KIND_FAKTURA)]
+
+        if not cj.step_reached(step, cj.ORDERED):
+            if row is not None:
+                fakturafil = write_invoice_csv(cursor, row, journal=journal, work_dir=run_dir)
+                files = working_files[id] = [(fakturafil, invoice_archive.KIND_FAKTURA)]
+            elif not fakturafil or not os.path.exists(fakturafil):
+                rowexists, fakturafil, _, _ = generate_invoice_csv(orchestrator_connection, conn, cursor,
+                                                                    invoice_id=id, journal=journal,
+                                                                    status_writer=status_writer, work_dir=run_dir)
+                if not rowexists:
+                    cj.record_step(journal, id, cj.ABANDONED)
+                    return
+                files = working_files[id] = [(fakturafil, invoice_archive.KIND_FAKTURA)]
+
+            # Structural check before spending a SAP test run on the file
+            errors = zfi_validator.validate_file(fakturafil)
+            if errors:
+                orchestrator_connection.log_error(
+                    f"Faktura {id}: fakturafilen er ugyldig, sendes til gennemsyn:\n" + "\n".join(errors))
+                status_writer.set_status(id, "TilGennemsyn", journal_step=cj.ABANDONED)
+                invoice_archive.archive_and_remove(archive, files, id)
+                return
+
+            def on_test_ok():
+                claim_leases.mark_posting(conn, id)  # Raises LeaseLost before the update run
+                cj.record_step(journal, id, cj.TEST_OK)
+
+            success, debitorsororder = run_zfi_fakturagrundlag(fakturafil, on_test_ok)
+            # Output file name based on date
+            if not success:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # remove last 3 digits → milliseconds
+                filename = os.path.join(run_dir, f"{id}_Debitorer_CSV_{timestamp}.csv")
+                debitor_csv = generate_csv(debitorsororder, filename)
+                files.append((debitor_csv, invoice_archive.KIND_DEBITOR))
+                create_debitors(debitor_csv)
+                success, debitorsororder = run_zfi_fakturagrundlag(fakturafil, on_test_ok)
+            if success:
+                if len(debitorsororder) == 1:
+                            ordernumber = debitorsororder[0]  # Extract the only item
+                else:
+                    raise RuntimeError("Flere ordrenumre fundet, der burde kun være et.")
             else:
-                raise RuntimeError("Flere ordrenumre fundet, der burde kun være et.")
-        else:
-            raise RuntimeError("Fejlede indlæsning efter debitoroprettelse")
-                
-        
-        send_invoice(orchestrator_connection)
-        cursor.execute("""
-            UPDATE [VejmanKassen].[dbo].[VejmanFakturering]
-            SET FakturaStatus = 'Faktureret',
-                FakturaDato        = CAST(GETDATE() AS date),
-                Ordrenummer        = ?
-            WHERE ID = ?
-        """, ordernumber, id)
-        conn.commit()
-        if vejmanid:
-            update_case(vejmanid, vejmantoken)
-        #os.remove(fakturafil)
-    else:
-        break
-    
+                raise RuntimeError("Fejlede indlæsning efter debitoroprettelse")
+            cj.record_step(journal, id, cj.ORDERED, ordernumber=ordernumber)
+            step = cj.ORDERED
+
+        return id, vejmanid, step, ordernumber, files
+
+
+    outcomes = deque(maxlen=SYSTEMIC_WINDOW)
+
+    def record_outcome(ok: bool):
+        outcomes.append(ok)
+        failures = outcomes.count(False)
+        if len(outcomes) >= SYSTEMIC_MIN_ROWS and failures > SYSTEMIC_FAILURE_SHARE * len(outcomes):
+            raise RuntimeError(f"{failures} af de seneste {len(outcomes)} fakturaer fejlede, stopper kørslen")
+
+
+    def process_isolated(id, vejmanid, step, fakturafil=None, ordernumber=None, row=None):
+        """process_invoice, but an invoice that fails is quarantined and the run goes on with the next one."""
+        try:
+            ordered = process_invoice(id, vejmanid, step, fakturafil, ordernumber, row)
+        except (pyodbc.Error, requests.RequestException):
+            working_files.pop(id, None)
+            raise  # Resource failures, not the row's fault
+        except Exception as e:
+            if existing_session() is None:
+                # SAP died under the invoice; the row stays in flight and is resumed once SAP is back
+                working_files.pop(id, None)
+                raise sap_navigation.SapUnavailable(f"SAP-sessionen forsvandt under faktura {id}: {e}") from e
+            quarantine(id, e)
+            record_outcome(False)
+            return None
+        working_files.pop(id, None)  # From here the files travel with the batch
+        record_outcome(True)
+        if ordered is None:
+            case_cache.discard(vejmanid)  # Dropped before SAP; no Vejman update will follow
+        return ordered
+
+
+    def quarantine(id, error):
+        """Take a failed invoice out of the queue ('Fejl' with the error text) and reset the SAP session."""
+        error_text = f"{type(error).__name__}: {error}"
+        files = working_files.pop(id, [])
+        try:
+            session = sap_navigation.get_session()
+            sbar = sap_navigation.status_text(session)
+            if sbar:
+                error_text += f"\nStatuslinje: {sbar}"
+            sap_navigation.return_to_start(session)
+        except Exception as e:
+            orchestrator_connection.log_error(f"Kunne ikke nulstille SAP-sessionen: {e}")
+
+        entry = cj.get_entry(journal, id)
+        if isinstance(error, claim_leases.LeaseLost):
+            # Another robot owns the row now; leave its status alone
+            orchestrator_connection.log_error(f"Faktura {id} opgives, rækken er ikke længere vores:\n{error_text}")
+            abandon(id, entry["vejman_id"] if entry is not None else None, files)
+            return
+        if entry is not None and entry["step"] in cj.FINAL_STEPS:
+            # Already dropped (e.g. TilGennemsyn) or finished; its status is not ours to change
+            orchestrator_connection.log_error(
+                f"Faktura {id} fejlede efter journal-trinnet '{entry['step']}', status ændres ikke:\n{error_text}")
+            return
+        if entry is not None and cj.step_reached(entry["step"], cj.TEST_OK):
+            # SAP may already hold the order; the row must not leave the journal
+            orchestrator_connection.log_error(
+                f"Faktura {id} fejlede efter ZFI_FAKTURAGRUNDLAG-opdateringen, kræver manuel kontrol:\n{error_text}")
+            return
+        if entry is not None:
+            case_cache.discard(entry["vejman_id"])
+        orchestrator_connection.log_error(f"Faktura {id} sat til '{FAILED}':\n{error_text}")
+        status_writer.set_failed(id, error_text)
+        if entry is not None and entry["csv_path"] not in (path for path, _ in files):
+            files.append((entry["csv_path"], invoice_archive.KIND_FAKTURA))
+        # Faktura and debitor file go to the archive together
+        invoice_archive.archive_and_remove(archive, files, id)
+
+
+    def abandon(id, vejmanid, files=()):
+        """Drop an invoice this robot no longer owns: journal it as abandoned and archive its files."""
+        cj.record_step(journal, id, cj.ABANDONED)
+        case_cache.discard(vejmanid)
+        invoice_archive.archive_and_remove(archive, files, id)
+
+
+    def release(batch):
+        """Release a batch of ordered invoices with one ZVF04 run. Returns the batch with its steps advanced."""
+        if any(not cj.step_reached(step, cj.RELEASED) for _, _, step, _, _ in batch):
+            # The ZVF04 rows are staged in the DB as they stream in, and only committed
+            # once the whole result list has passed the checks
+            sink = reconcile.ReleasedSink(conn)
+            try:
+                send_invoice(orchestrator_connection, sink)
+            except Exception:
+                sink.rollback()
+                raise
+            error = sink.commit()
+            if error is not None:
+                # The release has happened in SAP; failing to store its rows must not undo the batch
+                orchestrator_connection.log_error(f"Kunne ikke gemme {sink.count} ZVF04-rækker til afstemningen: {error}")
+
+        released = []
+        for id, vejmanid, step, ordernumber, files in batch:
+            if not cj.step_reached(step, cj.RELEASED):
+                cj.record_step(journal, id, cj.RELEASED)
+                step = cj.RELEASED
+            released.append((id, vejmanid, step, ordernumber, files))
+        return released
+
+
+    def commit(batch):
+        """Queue Faktureret for released invoices; the Vejman update follows the DB commit."""
+        for id, vejmanid, step, ordernumber, files in batch:
+            if not cj.step_reached(step, cj.DB_COMMITTED):
+                status_writer.set_invoiced(id, ordernumber, vejmanid=vejmanid, ordernumber=ordernumber, files=files)
+            else:
+                finish_committed([(id, "Faktureret", {"vejmanid": vejmanid, "ordernumber": ordernumber, "files": files})])
+
+
+    def finish_committed(flushed):
+        """Update Vejman and archive the working files for invoices whose Faktureret status has been committed."""
+        for id, status, extra in flushed:
+            if status != "Faktureret":
+                continue
+            if extra.get("vejmanid"):
+                update_case(extra["vejmanid"], vejmantoken, case_cache)
+            invoice_archive.archive_and_remove(archive, extra.get("files", []), id, extra.get("ordernumber"))
+            cj.record_step(journal, id, cj.DONE)
+
+    # Every commit of the status writer, whichever call triggered it, continues here
+    status_writer.on_commit = finish_committed
+
+
+    def run_queue():
+        """Process 'Afsendt' rows until the queue is empty. Returns the number of rows taken."""
+        nonlocal batch
+        handled = 0
+        while True:
+            row = claim_next(orchestrator_connection, conn, cursor, journal=journal,
+                             status_writer=status_writer, reader=reader)
+            rowexists = row is not None
+
+            if rowexists:
+                handled += 1
+                case_cache.prefetch([row.VejmanID])  # Fetched while SAP works on the invoice
+                started = time.monotonic()
+                # The invoice file is written inside the isolated path, so a bad row is quarantined
+                ordered = process_isolated(row.ID, row.VejmanID, cj.CLAIMED, row=row)
+                if drain:
+                    drain.record_order(time.monotonic() - started)
+                if ordered:
+                    batch.append(ordered)
+
+            if rowexists and len(batch) < (drain.batch_size if drain else 1):
+                continue
+
+            if batch:
+                # One ZVF04 release for the whole batch. A failed release leaves the orders in
+                # the billing due list; they are retried with the next batch.
+                started = time.monotonic()
+                try:
+                    released = release(batch)
+                except (pyodbc.Error, requests.RequestException):
+                    raise
+                except Exception as e:
+                    orchestrator_connection.log_error(f"Frigivelse af {len(batch)} ordre(r) i ZVF04 fejlede: {e}")
+                    try:
+                        sap_navigation.return_to_start(sap_navigation.get_session())
+                    except Exception:
+                        pass
+                    if drain:
+                        drain.record_release(len(batch), time.monotonic() - started, ok=False)
+                    if drain and drain.failing:
+                        raise
+                    if not rowexists:
+                        if args.daemon:
+                            return handled  # The batch waits; the next pass releases it again
+                        raise
+                    record_outcome(False)
+                    continue
+                if drain:
+                    drain.record_release(len(released), time.monotonic() - started, ok=True)
+                commit(released)
+                batch = []
+                if drain:
+                    orchestrator_connection.log_info(drain.progress(count_backlog(cursor)))
+
+            if not rowexists:
+                return handled
+
+
+    def ensure_resources():
+        """
+        Health-check the DB connection and the SAP session, and re-establish whichever is gone.
+        Also re-reads the Vejman token, so a long-lived worker picks up a rotated one.
+        """
+        nonlocal conn, cursor, vejmantoken
+        try:
+            cursor.execute("SELECT 1").fetchone()
+        except pyodbc.Error as e:
+            orchestrator_connection.log_info(f"SQL-forbindelsen er tabt, forbinder igen: {e}")
+            try:
+                conn.close()
+            except pyodbc.Error:
+                pass
+            conn = pyodbc.connect(conn_string)
+            cursor = conn.cursor()
+            status_writer.conn = conn
+        if existing_session() is None:
+            orchestrator_connection.log_info("SAP-sessionen er lukket, logger ind igen")
+            sap_navigation.reset_session()
+            if not initialize_sap(orchestrator_connection):
+                raise Exception("SAP failed to launch succesfully")
+        # Through the cache, so this costs a lookup only once per ttl
+        vejmantoken = orchestrator_connection.get_credential("VejmanToken").password
+        case_cache.token = vejmantoken
+
+
+    def resume_in_flight(skip_ids=()):
+        """Resume invoices left in flight by an interrupted run (or pass), except those in skip_ids."""
+        entries = [entry for entry in cj.in_flight(journal) if entry["invoice_id"] not in skip_ids]
+        case_cache.prefetch(entry["vejman_id"] for entry in entries)
+        for entry in entries:
+            if not cj.step_reached(entry["step"], cj.TEST_OK):
+                # No SAP work yet: the lease may have expired meanwhile and the row been claimed elsewhere
+                adopted = claim_leases.adopt_row(cursor, entry["invoice_id"])
+                conn.commit()
+                if not adopted:
+                    orchestrator_connection.log_info(
+                        f"Faktura {entry['invoice_id']} er ikke længere reserveret af denne robot, genoptages ikke")
+                    abandon(entry["invoice_id"], entry["vejman_id"], [(entry["csv_path"], invoice_archive.KIND_FAKTURA)])
+                    continue
+            orchestrator_connection.log_info(f"Genoptager faktura {entry['invoice_id']} efter trin '{entry['step']}'")
+            ordered = process_isolated(entry["invoice_id"], entry["vejman_id"], entry["step"], entry["csv_path"], entry["ordernumber"])
+            if ordered:
+                commit(release([ordered]))
+
+
+    batch = []
+
+    try:
+        resume_in_flight()
+
+        drain = DrainController() if args.drain else None
+        if drain:
+            orchestrator_connection.log_info(f"Afvikler kø på {count_backlog(cursor)} rækker")
+
+        if not args.daemon:
+            run_queue()
+            return
 
+        # Resident worker: keep SAP, DB and HTTP connections open and poll for new rows
+        orchestrator_connection.log_info("Kører som vedvarende worker")
+        delay = POLL_MIN_SECONDS
+        interrupted = False
+        while True:
+            try:
+                ensure_resources()
+                if interrupted:
+                    # Invoices the failed pass left halfway; those waiting in batch continue from there
+                    resume_in_flight({entry[0] for entry in batch})
+                    interrupted = False
+                handled = run_queue()
+                status_writer.flush()
+            except (pyodbc.Error, requests.RequestException) as e:
+                # Resource failures are repaired by ensure_resources on the next pass
+                orchestrator_connection.log_error(f"Forbindelsesfejl, genopretter: {e}")
+                if isinstance(e, requests.RequestException):
+                    update_vejman.reset_http_session()
+                interrupted = True
+                handled = 0
+            except (sap_navigation.SapUnavailable, pywintypes.com_error) as e:
+                # SAP failures: start the next pass from a clean session
+                orchestrator_connection.log_error(f"SAP-fejl, nulstiller sessionen: {e}")
+                try:
+                    sap_navigation.return_to_start(sap_navigation.get_session())
+                except Exception:
+                    pass
+                sap_navigation.reset_session()
+                interrupted = True
+                handled = 0
+            if handled:
+                delay = POLL_MIN_SECONDS
+                continue
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_SECONDS)
+    finally:
+        reader.close()
+        lease_keeper.stop()
+        # Checkpoint: whatever SAP has already released must reach the DB
+        status_writer.flush()
+        case_cache.close()
+        orchestrator_connection.log_info(orchestrator_connection.stats())
+        try:
+            os.rmdir(run_dir)  # Only succeeds once every working file has been archived
+        except OSError:
+            pass
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import csv
+import io
+import re
+from typing import Callable, Iterable, Mapping, NamedTuple, Optional, Tuple
+
+# Declarative layouts for the semicolon separated SAP input files.
+# Each field has a 1-based column position, an optional max width and either a
+# constant value or a formatter applied to the record value of the same name.
+# Columns not listed are written empty. An optional pattern describes what SAP
+# accepts in the field; Layout.check validates a written row against it.
+
+# Field formats of the ZFI_FAKTURAGRUNDLAG input file
+DATE = r"(0[1-9]|[12]\d|3[01])-(0[1-9]|1[0-2])-\d{4}"     # dd-mm-yyyy
+CUSTOMER_NUMBER = r"\d{10}"
+MATERIAL_NUMBER = r"\d{18}"
+AMOUNT = r"-?\d+(,\d+)?"                                  # decimal comma, no grouping
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value)
+
+
+class Field(NamedTuple):
+    name: str
+    pos: int
+    width: Optional[int] = None
+    formatter: Callable = _text
+    value: Optional[str] = None   # constant; the field is then not read from the record
+    pattern: Optional[str] = None # regex the written text must match in full
+
+
+def const(pos: int, value: str) -> Field:
+    return Field(f"_const{pos}", pos, len(value), _text, value)
+
+
+class Layout:
+    """A compiled row template: constants are filled once, render() only fills the variable slots."""
+
+    def __init__(self, name: str, columns: int, fields: Iterable[Field]):
+        self.name = name
+        self.columns = columns
+        self.fields = sorted(fields, key=lambda f: f.pos)
+        self._template = [""] * columns
+        self._slots = []
+        self._checks = []
+        seen = set()
+        for f in self.fields:
+            if not 1 <= f.pos <= columns:
+                raise ValueError(f"{name}.{f.name}: position {f.pos} uden for 1..{columns}")
+            if f.pos in seen:
+                raise ValueError(f"{name}: position {f.pos} er brugt to gange")
+            seen.add(f.pos)
+            self._checks.append((f.pos - 1, f.name, f.width, f.value, re.compile(f.pattern) if f.pattern else None))
+            if f.value is not None:
+                self._template[f.pos - 1] = f.value
+            else:
+                self._slots.append((f.pos - 1, f.name, f.width, f.formatter))
+
+    def render(self, record: Mapping) -> list:
+        row = self._template.copy()
+        for index, name, width, formatter in self._slots:
+            text = formatter(record.get(name))
+            if width is not None and len(text) > width:
+                raise ValueError(f"{self.name}.{name}: '{text}' er længere end {width} tegn")
+            row[index] = text
+        return row
+
+    def check(self, row: list) -> list:
+        """Problems with an already written row, as short Danish messages (empty if the row is valid)."""
+        if len(row) != self.columns:
+            return [f"{self.name}-linje har {len(row)} kolonner, forventede {self.columns}"]
+        errors = []
+        for index, name, width, value, pattern in self._checks:
+            text = row[index]
+            label = f"{name} (kolonne {index + 1})" if value is None else f"kolonne {index + 1}"
+            if value is not None and text != value:
+                errors.append(f"{label} skal være '{value}', er '{text}'")
+            elif width is not None and len(text) > width:
+                errors.append(f"{label} er længere end {width} tegn: '{text}'")
+            elif pattern is not None and not pattern.fullmatch(text):
+                errors.append(f"{label} har ugyldigt format: '{text}'")
+        return errors
+
+
+# ---------- ZFI_FAKTURAGRUNDLAG invoice file (H + L records, 36 columns) ----------
+
+INVOICE_HEADER = Layout("H", 36, [
+    const(1, "H"),
+    Field("kundenummer", 2, 10, pattern=CUSTOMER_NUMBER),
+    Field("fakturadato", 4, 10, pattern=DATE),
+    Field("bogfoeringsdato", 5, 10, pattern=DATE),
+    const(6, "0020"),
+    const(7, "20"),
+    const(8, "20"),
+    const(9, "ZRA"),
+    Field("tilladelsesnr", 10),
+    Field("kunde_ref_id", 15),
+    Field("toptekst", 16),
+    Field("startdato", 24, 10, pattern=DATE),
+    Field("startdato", 25, 10, pattern=DATE),
+    Field("slutdato", 26, 10, pattern=DATE),
+    Field("startdato", 29, 10, pattern=DATE),
+    Field("slutdato", 30, 10, pattern=DATE),
+    Field("fordringstype", 32),
+    Field("startdato", 35, 10, pattern=DATE),
+    Field("forfaldsdato", 36, 10, pattern=DATE),
+])
+
+INVOICE_LINE = Layout("L", 36, [
+    const(1, "L"),
+    Field("materialenummer", 2, 18, pattern=MATERIAL_NUMBER),
+    Field("fakturalinje", 3),
+    Field("antal", 4, pattern=AMOUNT),
+    Field("pris", 5, pattern=AMOUNT),
+    const(6, "NEJ"),
+    Field("psp_element", 7),
+    Field("forklaring", 12),
+])
+
+# ---------- ZFIE_OPRETDEB debitor file (22 columns) ----------
+
+DEBITOR = Layout("Debitor", 22, [
+    Field("debitornummer", 1),
+    const(2, "0020"),
+    const(3, "SE"),       # Identifier type (CVR = SE)
+    const(4, "0020"),
+    const(5, "20"),
+    const(6, "20"),
+    const(12, "DK"),
+    Field("ean", 13),
+    const(14, "91401000"),
+    const(16, "1"),
+    const(17, "Z003"),
+    const(18, "1"),
+    const(19, "DA"),
+    const(20, "DKK"),
+    const(21, "MWST"),
+])
+
+
+def write_records(path: str, records: Iterable[Tuple[Layout, Mapping]], encoding: str, mode: str = "w",
+                  **csv_options) -> int:
+    """
+    Render (layout, record) pairs into one in-memory buffer and write it to path in a
+    single call. Nothing is written if any record fails validation. Returns the row count.
+    """
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer, delimiter=";", **csv_options)
+    count = 0
+    for layout, record in records:
+        writer.writerow(layout.render(record))
+        count += 1
+    with open(path, mode=mode, newline="", encoding=encoding) as file:
+        file.write(buffer.getvalue())
+    return count
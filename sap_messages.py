@@ -0,0 +1,152 @@
+import re
+from typing import Iterable, List, NamedTuple, Optional
+
+# ---------- Message rules ----------
+# Every SAP result text the robot knows about is declared once here.
+# (kind, pattern, ignore_case). "{id}" marks the number to extract.
+# Patterns must match the whole (stripped) label text.
+
+EMPTY = "empty"
+ROW_NUMBER = "row_number"
+HEADER_FEJLLISTE = "header_fejlliste"
+HEADER_RAEKKE = "header_raekke_fejltekst"
+INPUT_FEJLFRI = "input_fejlfri"
+ORDREGIVER_INAKTIV = "ordregiver_inaktiv"
+FAKTURAMODTAGER_INAKTIV = "fakturamodtager_inaktiv"
+STANDARDORDRE_GEMT = "standardordre_gemt"
+DEBITOR_OPRETTET = "debitor_oprettet"
+DEBITOR_IKKE_KORREKT = "debitor_ikke_korrekt"
+DEBITOR_ALT_OK = "debitor_alt_ok"
+UNKNOWN = "unknown"
+
+RULES = [
+    (EMPTY, r"", False),
+    (ROW_NUMBER, r"\d+", False),
+    (HEADER_FEJLLISTE, r"Fejlliste vedr\. indlæsning.*", True),
+    (HEADER_RAEKKE, r"Række\s+Fejltekst", True),
+    (INPUT_FEJLFRI, r".*Input filen er fejlfri - klar til opdatering\..*", True),
+    (ORDREGIVER_INAKTIV, r"Ordregiver\s+{id}\s+er ikke aktiv i Salgsområde\s+\d+(?:\s\d+)*\.?", False),
+    (FAKTURAMODTAGER_INAKTIV, r"Fakturamodtager\s+{id}\s+er ikke aktiv i Salgsområde\s+\d+(?:\s\d+)*\.?", False),
+    (STANDARDORDRE_GEMT, r"KMD\s+Standardordre\s+{id}\s+gemt", True),
+    (DEBITOR_OPRETTET, r".*Følgende debitorer er operttet korrekt.*", False),
+    (DEBITOR_IKKE_KORREKT, r".*ikke korrekt.*", True),
+    (DEBITOR_ALT_OK, r".*alt er ok.*", True),
+]
+
+# Inactive customer messages carry a customer number of at least 10 digits
+_ID_PATTERNS = {
+    ORDREGIVER_INAKTIV: r"\d{10,}",
+    FAKTURAMODTAGER_INAKTIV: r"\d{10,}",
+}
+
+INAKTIV_KINDS = (ORDREGIVER_INAKTIV, FAKTURAMODTAGER_INAKTIV)
+HEADER_KINDS = (HEADER_FEJLLISTE, HEADER_RAEKKE)
+
+
+def _compile_rules(rules) -> re.Pattern:
+    """Build one alternation with a named group per rule (first match wins)."""
+    parts = []
+    for kind, pattern, ignore_case in rules:
+        id_pattern = _ID_PATTERNS.get(kind, r"\d+")
+        body = pattern.replace("{id}", f"(?P<{kind}__id>{id_pattern})")
+        if ignore_case:
+            body = f"(?i:{body})"
+        parts.append(f"(?P<{kind}>{body})")
+    return re.compile("|".join(parts))
+
+
+_MATCHER = _compile_rules(RULES)
+
+
+class Message(NamedTuple):
+    kind: str
+    text: str
+    ident: Optional[str] = None
+
+
+def classify(text: str) -> Message:
+    """Classify a single label text."""
+    text = (text or "").strip()
+    m = _MATCHER.fullmatch(text)
+    if not m:
+        return Message(UNKNOWN, text)
+    kind = m.lastgroup
+    return Message(kind, text, m.groupdict().get(f"{kind}__id"))
+
+
+def classify_labels(labels: Iterable[str]) -> List[Message]:
+    """Classify a whole label list in one pass."""
+    return [classify(text) for text in labels]
+
+
+def read_labels(container) -> List[str]:
+    """Stripped texts of all GuiLabel children of a SAP container, in screen order."""
+    labels = []
+    for child in container.Children:
+        if "lbl" in child.Id:  # SAP GUI labels usually have 'lbl' in their Id
+            try:
+                labels.append((child.Text or "").strip())
+            except Exception:
+                continue
+    return labels
+
+
+def strip_customer_prefix(ident: str) -> str:
+    """SAP pads customer numbers to 10 digits; CVR numbers lose the leading '00'."""
+    return ident[2:] if ident.startswith("00") else ident
+
+
+def messages_after(messages: List[Message], kind: str, label: str) -> List[Message]:
+    """Messages following the first message of the given kind; RuntimeError if it is missing."""
+    for i, msg in enumerate(messages):
+        if msg.kind == kind:
+            return messages[i + 1:]
+    raise RuntimeError(f"Kunne ikke finde '{label}' i labels; kan ikke validere.")
+
+
+def parse_saved_orders(messages: List[Message]) -> List[str]:
+    """
+    Standardordre numbers after the 'Række Fejltekst' header of a ZFI_FAKTURAGRUNDLAG
+    update run. Every non-empty entry must be 'KMD Standardordre <xyz> gemt'.
+    """
+    ids, bad_entries = [], []
+    for msg in messages_after(messages, HEADER_RAEKKE, "Række Fejltekst"):
+        if msg.kind == EMPTY:  # empty is allowed, skip it
+            continue
+        if msg.kind == STANDARDORDRE_GEMT:
+            ids.append(msg.ident)
+        else:
+            bad_entries.append(msg.text)
+
+    if bad_entries:
+        raise RuntimeError(
+            "Uventet tekst efter 'Række Fejltekst' (skal være 'KMD Standardordre <xyz> gemt' eller tom). "
+            f"Fandt i stedet: {bad_entries}"
+        )
+    return ids
+
+
+def parse_error_list(messages: List[Message]):
+    """
+    Pair the row/message entries after the 'Række Fejltekst' header of a
+    ZFI_FAKTURAGRUNDLAG test run error list (the title and the label before the
+    header are not part of the list).
+    Returns (inactive customer numbers, unexpected 'Række N: text' entries).
+    """
+    items = [m for m in messages_after(messages, HEADER_RAEKKE, "Række Fejltekst") if m.kind != EMPTY]
+
+    extracted_ids = set()
+    invalid_rows = []
+    i = 0
+    while i + 1 < len(items):
+        row, msg = items[i], items[i + 1]
+        i += 2
+        if msg.kind in INAKTIV_KINDS:
+            extracted_ids.add(strip_customer_prefix(msg.ident))
+        else:
+            invalid_rows.append(f"Række {row.text}: {msg.text}")
+
+    if i < len(items):
+        raise ValueError(f"❌ Uventet uparret fejltekst i slutningen:\n{items[i].text}")
+
+    return extracted_ids, invalid_rows
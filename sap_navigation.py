@@ -0,0 +1,178 @@
+import types
+import win32com.client
+
+# Direct transaction navigation. Every step jumps to its transaction with /n<TCODE>
+# from whatever screen the previous step left, instead of backing out to
+# SAP Easy Access with btn[12] and typing the code there.
+#
+# The session handed out by get_session caches element handles for the current
+# screen. The screen is only re-read from session.Info after an element method
+# (press, sendVKey, select, ...) has run, since only those can change it; when the
+# (transaction, screen number) differs from before, every cached handle is dropped.
+# A handle that has gone stale anyway (e.g. the same screen opened again) is
+# looked up again once; a method call that has been dispatched is never repeated.
+
+SELECTION_SCREEN = 1000
+
+_session = None
+
+
+class SapUnavailable(RuntimeError):
+    """The SAP GUI session is gone; a resource failure rather than a fault of the current invoice."""
+
+
+class CachedSession:
+    """SAP GUI session wrapper whose findById memoizes handles for the current screen."""
+
+    def __init__(self, session):
+        self._session = session
+        self._handles = {}    # element id -> handle on self._screen
+        self._screen = None   # (transaction, screen number) the handles belong to
+        self._stale = True    # Re-read the screen before the next lookup
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # Everything else (Info, Busy, ActiveWindow, ...) goes straight to the session
+        return getattr(self._session, name)
+
+    def screen_changed(self):
+        self._stale = True
+
+    def invalidate(self):
+        self._handles.clear()
+        self._screen = None
+        self._stale = True
+
+    def _resolve(self, element_id: str, refresh: bool = False):
+        if self._stale:
+            screen = current_location(self._session)
+            if screen != self._screen:
+                self._handles.clear()  # Handles of the previous screen are dead
+            self._screen, self._stale = screen, False
+        handle = None if refresh else self._handles.get(element_id)
+        if handle is None:
+            self.misses += 1
+            handle = self._session.findById(element_id)
+            self._handles[element_id] = handle
+        else:
+            self.hits += 1
+        return handle
+
+    def findById(self, element_id: str):
+        self._resolve(element_id)  # Raises like findById if the element is not on the screen
+        return _Element(self, element_id)
+
+
+class _Element:
+    """
+    Handle proxy going through the cache. Property reads and writes (idempotent) are
+    retried once with a fresh handle. For a method the handle is checked with a cheap
+    property read first, so a stale one is replaced before the call; the call itself
+    is never retried.
+    """
+
+    __slots__ = ("_owner", "_id")
+
+    def __init__(self, owner: CachedSession, element_id: str):
+        object.__setattr__(self, "_owner", owner)
+        object.__setattr__(self, "_id", element_id)
+
+    def _with_retry(self, action):
+        try:
+            return action(self._owner._resolve(self._id))
+        except Exception:
+            self._owner.screen_changed()
+            return action(self._owner._resolve(self._id, refresh=True))
+
+    def __getattr__(self, name):
+        # Only the lookup is retried. A method (press, sendVKey, ...) is called exactly
+        # once: if it fails after SAP has acted on it, running it again could post twice.
+        def lookup(handle):
+            value = getattr(handle, name)
+            if isinstance(value, types.MethodType):
+                handle.Id  # Fails on a stale handle, unlike getattr of a method
+            return value
+
+        value = self._with_retry(lookup)
+        if not isinstance(value, types.MethodType):
+            return value
+
+        def call(*args):
+            try:
+                return value(*args)
+            finally:
+                self._owner.screen_changed()
+        return call
+
+    def __setattr__(self, name, value):
+        self._with_retry(lambda handle: setattr(handle, name, value))
+
+
+def get_session() -> CachedSession:
+    """The first SAP GUI session, wrapped in a CachedSession that is kept for the run."""
+    global _session
+    if _session is None:
+        SapGuiAuto = win32com.client.GetObject("SAPGUI")
+        application = SapGuiAuto.GetScriptingEngine
+        connection = application.Children(0)
+        _session = CachedSession(connection.Children(0))
+    return _session
+
+
+def reset_session():
+    """Forget the cached session, e.g. after SAP has been restarted."""
+    global _session
+    _session = None
+
+
+def current_location(session):
+    """(transaction code, screen number) the session is on."""
+    info = session.Info
+    return info.Transaction, info.ScreenNumber
+
+
+def goto_transaction(session, tcode: str, screen: int = SELECTION_SCREEN) -> bool:
+    """
+    Open tcode, skipping the round trip if the session is already on that
+    transaction and screen. Returns True if it navigated.
+    """
+    if current_location(session) == (tcode, screen):
+        return False
+    restart_transaction(session, tcode)
+    return True
+
+
+def restart_transaction(session, tcode: str):
+    """Jump to the initial screen of tcode from any screen (also re-enters the current one)."""
+    session.findById("wnd[0]/tbar[0]/okcd").text = f"/n{tcode}"
+    session.findById("wnd[0]").sendVKey(0)
+
+
+def back_to_selection(session):
+    """From a report list, go back one screen to its selection screen (keeps the entered values)."""
+    session.findById("wnd[0]/tbar[0]/btn[12]").press()
+
+
+def status_text(session) -> str:
+    """Text in the status bar of the main window ('' if none)."""
+    try:
+        return (session.findById("wnd[0]/sbar").Text or "").strip()
+    except Exception:
+        return ""
+
+
+def return_to_start(session):
+    """
+    Bring the session back to a clean state after a failed step: close popups,
+    leave the current transaction with /n and forget cached handles.
+    """
+    for _ in range(5):
+        window = session.ActiveWindow
+        if window.Name == "wnd[0]":
+            break
+        window.sendVKey(12)  # Cancel
+    session.findById("wnd[0]/tbar[0]/okcd").text = "/n"
+    session.findById("wnd[0]").sendVKey(0)
+    if isinstance(session, CachedSession):
+        session.invalidate()
@@ -0,0 +1,49 @@
+from datetime import date
+from decimal import Decimal
+import pyodbc
+
+# Orders a fetched chunk of claimable rows before it is processed:
+#   1. customers SAP does not know yet first, so debitor creation happens back to back
+#   2. grouped by TilladelsesType, so consecutive invoices use the same Fakturatekster template
+#      (InvoiceReader fetches each template once per chunk)
+#   3. within a group, by priority lane
+# Chunks are fetched in ID order and drained completely before the next one,
+# so no row waits behind more than one chunk of newer rows.
+
+LANES = {
+    "fifo": lambda row: row.ID,
+    # Earliest permit start first
+    "due": lambda row: (row.Startdato or date.max, row.ID),
+    # Largest amount first
+    "amount": lambda row: (-(row.TotalPris or Decimal(0)), row.ID),
+}
+
+
+def known_customers(cursor: pyodbc.Cursor, rows) -> set:
+    """CvrNr values in rows that already have an invoiced (Faktureret) row, i.e. exist as debitors."""
+    cvrs = sorted({str(row.CvrNr) for row in rows if row.CvrNr is not None})
+    if not cvrs:
+        return set()
+    placeholders = ", ".join("?" for _ in cvrs)
+    cursor.execute(f"""
+        SELECT DISTINCT CvrNr
+        FROM [VejmanKassen].[dbo].[VejmanFakturering]
+        WHERE FakturaStatus = 'Faktureret' AND CvrNr IN ({placeholders})
+    """, *cvrs)
+    return {str(r[0]) for r in cursor.fetchall()}
+
+
+def schedule(rows, known: set, lane: str = "fifo"):
+    """Return rows in processing order (see module comment)."""
+    lane_key = LANES[lane]
+
+    # Groups keep the position of their first (lowest ID) row, so group order stays stable
+    group_rank = {}
+    for row in sorted(rows, key=lambda r: r.ID):
+        group_rank.setdefault(row.TilladelsesType, len(group_rank))
+
+    return sorted(rows, key=lambda row: (
+        str(row.CvrNr) in known,
+        group_rank[row.TilladelsesType],
+        lane_key(row),
+    ))
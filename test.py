@@ -1,13 +1,33 @@
 #!/usr/bin/env python3
+import argparse
+import codecs
+import hashlib
 import json
+import os
+import re
 import sys
-from typing import Any, List, Tuple
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
 
 # Toggle this to treat lists as ordered (True) or compare them item-by-item where possible (False).
 STRICT_LIST_ORDER = True
 
-def load_json(path: str) -> Any:
-    with open(path, "r", encoding="ANSI") as f:
+# Order-insensitive matching of list elements by key, per list path. "[*]" matches any index.
+# Key paths may be dotted ("meta.id"). Lists without a key are matched by structural hash.
+LIST_KEYS = {
+    "$.case_set": "id",
+}
+
+_MISSING = object()
+
+class Diff(NamedTuple):
+    kind: str       # "ADDED", "REMOVED", "CHANGED", "TYPE", "LENGTH", "INFO"
+    path: str       # JSON path of the node, e.g. $.case_set[0].id
+    message: str
+
+def load_json(path: str, encoding: str = "ANSI") -> Any:
+    with open(path, "r", encoding=encoding) as f:
         return json.load(f)
 
 def type_name(x: Any) -> str:
@@ -31,80 +51,206 @@ def join_path(parts: List[str]) -> str:
                 out += f"[{json.dumps(p)}]"
     return out
 
-def compare(a: Any, b: Any, path: List[str], diffs: List[Tuple[str, str]]):
+def _only_in(path: List[str], key: str, side: str) -> Diff:
+    path.append(key)
+    p = join_path(path)
+    path.pop()
+    kind = "REMOVED" if side == "Json1" else "ADDED"
+    return Diff(kind, p, f"{p} present only in {side}")
+
+def pattern_path(parts: List[str]) -> str:
+    """Like join_path, but with list indexes replaced by [*] (for LIST_KEYS lookups)."""
+    return "$" + "".join("[*]" if p.isdigit() else join_path([p])[1:] for p in parts)
+
+def _key_of(x: Any, key_path: str) -> Any:
+    for part in key_path.split("."):
+        if not isinstance(x, dict) or part not in x:
+            return _MISSING
+        x = x[part]
+    return x if is_scalar(x) else json.dumps(x, sort_keys=True)
+
+def _structural_hash(x: Any, memo: dict) -> str:
     """
-    Populate diffs with tuples of (kind, message) where kind in:
-      - "ADDED", "REMOVED", "CHANGED", "TYPE", "LENGTH", "INFO"
+    Canonical hash of a subtree, computed bottom-up without recursion. Container
+    hashes are memoized by node id in memo (one memo per diff), so each subtree is
+    hashed once however many list levels ask for it.
+    """
+    if is_scalar(x):
+        return json.dumps(x)
+    stack = [(x, False)]
+    while stack:
+        node, ready = stack.pop()
+        if id(node) in memo:
+            continue
+        children = node.values() if isinstance(node, dict) else node
+        if not ready:
+            stack.append((node, True))
+            stack.extend((c, False) for c in children if not is_scalar(c) and id(c) not in memo)
+            continue
+        h = lambda c: json.dumps(c) if is_scalar(c) else memo[id(c)]
+        if isinstance(node, dict):
+            body = "{" + ",".join(f"{json.dumps(k)}:{h(v)}" for k, v in sorted(node.items())) + "}"
+        else:
+            body = "[" + ",".join(h(c) for c in node) + "]"
+        memo[id(node)] = hashlib.sha1(body.encode("utf-8")).hexdigest()
+    return memo[id(x)]
+
+def _match_list(a: list, b: list, key_path: Optional[str], memo: dict) -> Tuple[List[Tuple[int, int]], List[int], List[int]]:
+    """
+    Pair up elements of a and b in O(n). With key_path, elements with equal keys
+    are paired (and compared further); the rest, and all elements when no key is
+    configured, are paired only if structurally identical.
+    Returns (pairs to compare, unmatched a indexes, unmatched b indexes).
+    """
+    pairs: List[Tuple[int, int]] = []
+    rest_a, rest_b = list(range(len(a))), list(range(len(b)))
+
+    if key_path:
+        by_key = {}
+        for i in rest_a:
+            k = _key_of(a[i], key_path)
+            if k is not _MISSING and k not in by_key:
+                by_key[k] = i
+        unkeyed_b = []
+        for j in rest_b:
+            i = by_key.pop(_key_of(b[j], key_path), None)
+            if i is None:
+                unkeyed_b.append(j)
+            else:
+                pairs.append((i, j))
+        paired_a = {i for i, _ in pairs}
+        rest_a = [i for i in rest_a if i not in paired_a]
+        rest_b = unkeyed_b
+
+    # Identical elements cancel out; whatever is left over was added or removed
+    buckets = {}
+    for i in rest_a:
+        buckets.setdefault(_structural_hash(a[i], memo), []).append(i)
+    only_b = []
+    for j in rest_b:
+        bucket = buckets.get(_structural_hash(b[j], memo))
+        if bucket:
+            bucket.pop()
+        else:
+            only_b.append(j)
+    only_a = sorted(i for bucket in buckets.values() for i in bucket)
+    return pairs, only_a, only_b
+
+def _expand(a: Any, b: Any, path: List[str], strict: bool, list_keys: dict, memo: dict) -> Tuple[List[Diff], Optional[Iterator[Tuple[str, Any, Any]]]]:
+    """
+    Compare one node pair. Returns the diffs found at this node and an iterator
+    over (key, child_a, child_b) pairs to descend into (None for leaves).
     """
     # Types differ
     if type(a) != type(b):
-        diffs.append(("TYPE",
-                      f"{join_path(path)} type differs: {type_name(a)} vs {type_name(b)}"))
-        return
+        p = join_path(path)
+        return [Diff("TYPE", p, f"{p} type differs: {type_name(a)} vs {type_name(b)}")], None
 
     # Scalars: compare directly
     if is_scalar(a):
         if a != b:
-            diffs.append(("CHANGED",
-                          f"{join_path(path)} value differs: {repr(a)} → {repr(b)}"))
-        return
+            p = join_path(path)
+            return [Diff("CHANGED", p, f"{p} value differs: {repr(a)} → {repr(b)}")], None
+        return [], None
 
-    # Dicts: compare keys and recurse
+    # Dicts: compare keys and descend into the shared ones
     if isinstance(a, dict):
         a_keys = set(a.keys())
         b_keys = set(b.keys())
-        for k in sorted(a_keys - b_keys):
-            diffs.append(("REMOVED", f"{join_path(path + [str(k)])} present only in Json1"))
-        for k in sorted(b_keys - a_keys):
-            diffs.append(("ADDED", f"{join_path(path + [str(k)])} present only in Json2"))
-        for k in sorted(a_keys & b_keys):
-            compare(a[k], b[k], path + [str(k)], diffs)
-        return
+        diffs = [_only_in(path, str(k), "Json1") for k in sorted(a_keys - b_keys)]
+        diffs += [_only_in(path, str(k), "Json2") for k in sorted(b_keys - a_keys)]
+        return diffs, ((str(k), a[k], b[k]) for k in sorted(a_keys & b_keys))
 
     # Lists: compare length and items
-    if isinstance(a, list):
-        if STRICT_LIST_ORDER:
-            if len(a) != len(b):
-                diffs.append(("LENGTH",
-                              f"{join_path(path)} list length differs: {len(a)} vs {len(b)}"))
-            # Compare up to the min length
-            for i in range(min(len(a), len(b))):
-                compare(a[i], b[i], path + [str(i)], diffs)
-            # Report extra tail items explicitly
-            for i in range(len(a) - 1, len(b) - 1, -1):
-                if i >= len(b):
-                    diffs.append(("REMOVED", f"{join_path(path + [str(i)])} present only in Json1"))
-            for i in range(len(b) - 1, len(a) - 1, -1):
-                if i >= len(a):
-                    diffs.append(("ADDED", f"{join_path(path + [str(i)])} present only in Json2"))
+    diffs = []
+    if len(a) != len(b):
+        p = join_path(path)
+        diffs.append(Diff("LENGTH", p, f"{p} list length differs: {len(a)} vs {len(b)}"))
+
+    if not strict:
+        if all(is_scalar(x) for x in a + b):
+            # Multiset-like comparison for scalars
+            if sorted(a) != sorted(b):
+                p = join_path(path)
+                diffs.append(Diff("CHANGED", p, f"{p} list items differ (order-insensitive)"))
+            return diffs, None
+
+        key_path = list_keys.get(join_path(path)) or list_keys.get(pattern_path(path))
+        pairs, only_a, only_b = _match_list(a, b, key_path, memo)
+        diffs += [_only_in(path, str(i), "Json1") for i in only_a]
+        diffs += [_only_in(path, str(j), "Json2") for j in only_b]
+        # Paired elements are reported under their Json1 index
+        return diffs, ((str(i), a[i], b[j]) for i, j in pairs)
+
+    # Report extra tail items explicitly, then compare up to the min length
+    n = min(len(a), len(b))
+    diffs += [_only_in(path, str(i), "Json1") for i in range(n, len(a))]
+    diffs += [_only_in(path, str(i), "Json2") for i in range(n, len(b))]
+    return diffs, ((str(i), a[i], b[i]) for i in range(n))
+
+def iter_diffs(a: Any, b: Any, skip: Iterable[str] = (), max_diffs: Optional[int] = None,
+               strict: Optional[bool] = None, list_keys: Optional[dict] = None) -> Iterator[Diff]:
+    """
+    Lazily yield Diff records for a vs b.
+
+    The tree is walked depth-first with an explicit stack and a single shared
+    path list, so deep documents do not hit the recursion limit. Subtrees whose
+    JSON path is in `skip` (e.g. "$.case_set") are not compared. Stops after
+    `max_diffs` diffs when given. `strict` and `list_keys` default to
+    STRICT_LIST_ORDER and LIST_KEYS.
+    """
+    strict = STRICT_LIST_ORDER if strict is None else strict
+    list_keys = LIST_KEYS if list_keys is None else list_keys
+    skip = frozenset(skip)
+    path: List[str] = []
+    memo: dict = {}   # structural hashes by node id, see _structural_hash
+    emitted = 0
+
+    diffs, children = _expand(a, b, path, strict, list_keys, memo)
+    stack = [children] if children is not None else []
+    for d in diffs:
+        if max_diffs is not None and emitted >= max_diffs:
+            return
+        emitted += 1
+        yield d
+
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            # Frame exhausted: leave this node
+            stack.pop()
+            if path:
+                path.pop()
+            continue
+
+        key, ca, cb = child
+        path.append(key)
+        if skip and join_path(path) in skip:
+            path.pop()
+            continue
+
+        diffs, children = _expand(ca, cb, path, strict, list_keys, memo)
+        for d in diffs:
+            if max_diffs is not None and emitted >= max_diffs:
+                return
+            emitted += 1
+            yield d
+        if children is None:
+            path.pop()
         else:
-            # Heuristic: try to match dict/list elements by value; fall back to index
-            if len(a) != len(b):
-                diffs.append(("LENGTH",
-                              f"{join_path(path)} list length differs: {len(a)} vs {len(b)}"))
-
-            # Attempt multiset-like comparison for scalars
-            if all(is_scalar(x) for x in a + b):
-                a_sorted = sorted(a)
-                b_sorted = sorted(b)
-                if a_sorted != b_sorted:
-                    diffs.append(("CHANGED",
-                                  f"{join_path(path)} list items differ (order-insensitive)"))
-            else:
-                # Compare element-by-element up to min length
-                for i in range(min(len(a), len(b))):
-                    compare(a[i], b[i], path + [str(i)], diffs)
-                # Report extras
-                for i in range(min(len(a), len(b)), len(a)):
-                    diffs.append(("REMOVED", f"{join_path(path + [str(i)])} present only in Json1"))
-                for i in range(min(len(a), len(b)), len(b)):
-                    diffs.append(("ADDED", f"{join_path(path + [str(i)])} present only in Json2"))
-        return
+            stack.append(children)
 
-def print_diffs(diffs: List[Tuple[str, str]]):
-    if not diffs:
-        print("✔ No differences found.")
-        return
+def compare(a: Any, b: Any, path: List[str], diffs: List[Tuple[str, str]]):
+    """
+    Populate diffs with tuples of (kind, message) where kind in:
+      - "ADDED", "REMOVED", "CHANGED", "TYPE", "LENGTH", "INFO"
+    `path` is accepted for compatibility; diffs are always rooted at "$".
+    """
+    diffs.extend((d.kind, d.message) for d in iter_diffs(a, b))
+
+def print_diffs(diffs: Iterable, out: TextIO = sys.stdout, color: bool = True,
+                limit: Optional[int] = None) -> int:
+    """Print diffs as they arrive, at most limit of them. Returns the number of diffs printed."""
     # Minimal color if terminal supports ANSI (safe to print regardless)
     COLORS = {
         "ADDED": "\033[32m",    # green
@@ -114,19 +260,137 @@ def print_diffs(diffs: List[Tuple[str, str]]):
         "LENGTH": "\033[36m",   # cyan
         "INFO": "\033[34m",     # blue
     }
-    RESET = "\033[0m"
-    for kind, msg in diffs:
-        color = COLORS.get(kind, "")
-        print(f"{color}{kind:<7}{RESET} {msg}")
+    RESET = "\033[0m" if color else ""
+    count, truncated = 0, False
+    for d in diffs:
+        if limit is not None and count >= limit:
+            truncated = True
+            break
+        kind, msg = d[0], d[-1]
+        c = COLORS.get(kind, "") if color else ""
+        print(f"{c}{kind:<7}{RESET} {msg}", file=out)
+        count += 1
+    if truncated:
+        print(f"… Output truncated: showing {count} diff(s) (--max-diffs {limit}).", file=out)
+    elif not count:
+        print("✔ No differences found.", file=out)
+    return count
+
+# ---------- Batch mode ----------
+
+# The only change a Vejman update is expected to make (see update_vejman.update_case)
+EXPECTED_CHANGES = ("$.authority_reference_number",)
+
+INDEX_RE = re.compile(r"\[\d+\]")
+
+def _diff_pair(job: tuple) -> dict:
+    """Diff one snapshot pair (runs in a worker process)."""
+    name, path1, path2, encoding, options, expected = job
+    result = {"name": name, "kinds": {}, "paths": {}, "total": 0, "error": None, "matches_expected": False}
+    try:
+        a = load_json(path1, encoding)
+        b = load_json(path2, encoding)
+    except (OSError, ValueError, LookupError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    # Classify on the full diff; max_diffs only limits printed output
+    kinds, paths, seen = Counter(), Counter(), set()
+    for d in iter_diffs(a, b, **dict(options, max_diffs=None)):
+        kinds[d.kind] += 1
+        paths[INDEX_RE.sub("[*]", d.path)] += 1
+        seen.add((d.kind, d.path))
+    result.update(kinds=dict(kinds), paths=dict(paths), total=sum(kinds.values()))
+    result["matches_expected"] = seen == {("CHANGED", p) for p in expected}
+    return result
+
+def diff_directories(dir1: str, dir2: str, encoding: str, options: dict, expected=EXPECTED_CHANGES,
+                     workers: Optional[int] = None, top: int = 20) -> dict:
+    """
+    Pair files in dir1/dir2 by name, diff each pair in a process pool and
+    return a summary with counts per kind and per path (indexes as [*]).
+    """
+    names1 = {e.name for e in os.scandir(dir1) if e.is_file()}
+    names2 = {e.name for e in os.scandir(dir2) if e.is_file()}
+    shared = sorted(names1 & names2)
+    jobs = [(n, os.path.join(dir1, n), os.path.join(dir2, n), encoding, options, tuple(expected)) for n in shared]
+
+    kinds, paths = Counter(), Counter()
+    pairs, unexpected, errors = [], [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for res in pool.map(_diff_pair, jobs, chunksize=8):
+            pairs.append(res)
+            if res["error"]:
+                errors.append({"name": res["name"], "error": res["error"]})
+                continue
+            kinds.update(res["kinds"])
+            paths.update(res["paths"])
+            if not res["matches_expected"]:
+                unexpected.append({"name": res["name"], "total": res["total"], "paths": res["paths"]})
+
+    return {
+        "dir1": os.path.abspath(dir1),
+        "dir2": os.path.abspath(dir2),
+        "pairs_compared": len(shared),
+        "pairs_with_diffs": sum(1 for p in pairs if p["total"]),
+        "only_in_dir1": sorted(names1 - names2),
+        "only_in_dir2": sorted(names2 - names1),
+        "diffs_by_kind": dict(kinds),
+        "diffs_by_path": dict(paths),
+        "top_changed_paths": paths.most_common(top),
+        "expected_changes": list(expected),
+        "unexpected_pairs": unexpected,
+        "errors": errors,
+    }
 
-def main():
-    # Filenames exactly as given, assumed to be in the project folder
-    file1 = "Json1.txt"
-    file2 = "Json2.txt"
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diff two JSON documents (e.g. Vejman case dumps), "
+                                                 "or two directories of them pairwise by file name.")
+    # Filenames default to the ones in the project folder
+    parser.add_argument("file1", nargs="?", default="Json1.txt")
+    parser.add_argument("file2", nargs="?", default="Json2.txt")
+    parser.add_argument("--encoding", default="ANSI")
+    parser.add_argument("--max-diffs", type=int, default=None, help="Stop after this many diffs.")
+    parser.add_argument("--skip", action="append", default=[], metavar="PATH",
+                        help="JSON path of a subtree to ignore, e.g. '$.case_set'. Repeatable.")
+    parser.add_argument("--out", default=None, help="Write diffs to this file instead of the console.")
+    parser.add_argument("--unordered", action="store_true", help="Compare lists order-insensitively.")
+    parser.add_argument("--key", action="append", default=[], metavar="PATH=KEY",
+                        help="Match elements of the list at PATH by KEY, e.g. '$.case_set=id'. Repeatable.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes in directory mode.")
+    parser.add_argument("--summary", default="diff_summary.json", help="Summary file in directory mode.")
+    parser.add_argument("--expect", action="append", default=[], metavar="PATH",
+                        help="Path expected to change in every pair (directory mode). "
+                             "Defaults to $.authority_reference_number. Repeatable.")
+    args = parser.parse_args(argv)
+
+    list_keys = dict(LIST_KEYS)
+    for spec in args.key:
+        list_path, sep, key_path = spec.rpartition("=")
+        if not sep or not list_path or not key_path:
+            parser.error(f"--key must look like PATH=KEY, got '{spec}'")
+        list_keys[list_path] = key_path
+    try:
+        codecs.lookup(args.encoding)
+    except LookupError:
+        parser.error(f"unknown --encoding '{args.encoding}'")
+
+    options = {"skip": args.skip, "max_diffs": args.max_diffs,
+               "strict": not args.unordered and STRICT_LIST_ORDER, "list_keys": list_keys}
+
+    if os.path.isdir(args.file1) and os.path.isdir(args.file2):
+        summary = diff_directories(args.file1, args.file2, args.encoding, options,
+                                   expected=args.expect or EXPECTED_CHANGES, workers=args.workers)
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"{summary['pairs_compared']} pairs compared, {summary['pairs_with_diffs']} with differences, "
+              f"{len(summary['unexpected_pairs'])} not matching the expected change, "
+              f"{len(summary['errors'])} errors. Summary written to {args.summary}")
+        return
 
     try:
-        a = load_json(file1)
-        b = load_json(file2)
+        a = load_json(args.file1, args.encoding)
+        b = load_json(args.file2, args.encoding)
     except FileNotFoundError as e:
         print(f"File not found: {e.filename}", file=sys.stderr)
         sys.exit(1)
@@ -134,9 +398,13 @@ def main():
         print(f"JSON parse error in {e.doc[:40]}... at pos {e.pos}: {e}", file=sys.stderr)
         sys.exit(2)
 
-    diffs: List[Tuple[str, str]] = []
-    compare(a, b, [], diffs)
-    print_diffs(diffs)
+    # max_diffs is applied while printing, so a truncated diff is not reported as empty
+    diffs = iter_diffs(a, b, **dict(options, max_diffs=None))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            print_diffs(diffs, f, color=False, limit=args.max_diffs)
+    else:
+        print_diffs(diffs, limit=args.max_diffs)
 
 if __name__ == "__main__":
     main()
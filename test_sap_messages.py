@@ -0,0 +1,39 @@
+import pytest
+
+import sap_messages
+
+# Label texts of a ZFI_FAKTURAGRUNDLAG test run with inactive customers, in screen
+# order as read_labels returns them: title, the label before the header, the
+# header, then row number / (blank) / message.
+ERROR_LIST_DUMP = [
+    "Fejlliste vedr. indlæsning af fakturagrundlag",
+    "2025-10-01_08-15-02-123_Fakturaer_4711.csv",
+    "Række Fejltekst",
+    "1",
+    "Ordregiver 0012345678 er ikke aktiv i Salgsområde 0020 20 20.",
+    "",
+    "1",
+    "Fakturamodtager 0012345678 er ikke aktiv i Salgsområde 0020 20 20.",
+    "",
+    "2",
+    "Ordregiver 0087654321 er ikke aktiv i Salgsområde 0020 20 20",
+    "",
+]
+
+
+def test_parse_error_list_pairs_rows_after_header():
+    ids, invalid_rows = sap_messages.parse_error_list(sap_messages.classify_labels(ERROR_LIST_DUMP))
+    assert ids == {"12345678", "87654321"}
+    assert invalid_rows == []
+
+
+def test_parse_error_list_reports_unexpected_messages():
+    labels = ERROR_LIST_DUMP + ["3", "Materialenummer findes ikke"]
+    ids, invalid_rows = sap_messages.parse_error_list(sap_messages.classify_labels(labels))
+    assert ids == {"12345678", "87654321"}
+    assert invalid_rows == ["Række 3: Materialenummer findes ikke"]
+
+
+def test_parse_error_list_requires_header():
+    with pytest.raises(RuntimeError):
+        sap_messages.parse_error_list(sap_messages.classify_labels(ERROR_LIST_DUMP[3:]))
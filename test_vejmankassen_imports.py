@@ -0,0 +1,58 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+# Modules the audit and diff tools must never load (see vejmankassen.py)
+HEAVY = ("pyodbc", "win32com", "pywintypes", "selenium", "OpenOrchestrator")
+
+# Cumulative import time of the subcommand's module, in microseconds (-X importtime)
+IMPORT_BUDGET_US = 500_000
+
+RUNNER = """
+import json, sys
+import vejmankassen
+try:
+    vejmankassen.main(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+def run_command(args):
+    """Run a vejmankassen subcommand in a fresh interpreter. Returns (loaded modules, {module: cumulative us})."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", RUNNER, *args],
+                          cwd=REPO, capture_output=True, text=True, timeout=60)
+    lines = proc.stderr.splitlines()
+    modules = json.loads(lines[-1])
+    cumulative = {}
+    for line in lines:
+        if line.startswith("import time:") and "|" in line:
+            _, cum, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            if cum.isdigit():
+                cumulative[name] = int(cum)
+    return modules, cumulative
+
+
+def heavy_loaded(modules):
+    return [m for m in modules if m.split(".")[0] in HEAVY]
+
+
+def test_verify_imports_no_heavy_modules():
+    modules, cumulative = run_command(["verify", "--help"])
+    assert "verify_cpr_cvr" in modules
+    assert heavy_loaded(modules) == []
+    assert cumulative["verify_cpr_cvr"] < IMPORT_BUDGET_US
+
+
+def test_diff_imports_no_heavy_modules(tmp_path):
+    a, b = tmp_path / "a.json", tmp_path / "b.json"
+    a.write_text('{"x": 1}', encoding="utf-8")
+    b.write_text('{"x": 2}', encoding="utf-8")
+    modules, cumulative = run_command(["diff", str(a), str(b), "--encoding", "utf-8"])
+    assert "test" in modules
+    assert heavy_loaded(modules) == []
+    assert cumulative["test"] < IMPORT_BUDGET_US
@@ -1,20 +1,90 @@
 
 import json
 import requests
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-def update_case(case_id, token):
+# One HTTP session for the run, so the connection to Vejman is kept alive between cases
+http = requests.Session()
 
-    response = requests.get(f"https://vejman.vd.dk/permissions/getcase?caseid={case_id}&token={token}")
-    response.raise_for_status()
-    json_object = response.json().get('data')
 
-    filtered_data = {k: json_object[k] for k in [
+def reset_http_session():
+    """Drop pooled connections after a network failure; the next request reconnects."""
+    global http
+    http.close()
+    http = requests.Session()
+
+
+CASE_FIELDS = [
     "type", "variant", "origin", "state", "year", "serial_number", "authority_reference_number", 
     "start_date", "end_date", "initials", "visuser_id", "created_date", "created_user", 
     "modified_date", "modified_user", "connected_case", "bestyrer", "community", 
     "majorVersion", "minorVersion", "authName", "authEmail", "case_set", "brokerCaseState", "id"
-    ] if k in json_object}
+]
+
+
+def fetch_case(case_id, token, session: requests.Session = None):
+    """GET a case and keep only the fields setcase needs (incl. majorVersion/minorVersion and modified_date)."""
+    response = (session or http).get(f"https://vejman.vd.dk/permissions/getcase?caseid={case_id}&token={token}")
+    response.raise_for_status()
+    json_object = response.json().get('data')
+    return {k: json_object[k] for k in CASE_FIELDS if k in json_object}
+
+
+class CaseCache:
+    """
+    Case payloads fetched ahead of time, e.g. when the invoice row is claimed, so that
+    update_case can POST straight away. The GETs run on background threads while SAP
+    works on the invoice. Entries are removed when used or discarded. Each worker
+    thread has its own HTTP session; the module-level one belongs to the main thread.
+    """
+
+    def __init__(self, token, workers: int = 4):
+        self.token = token
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vejman-prefetch")
+        self._pending = {}
+        self._local = threading.local()
+        self._sessions = []
+
+    def _fetch(self, case_id):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            self._sessions.append(session)
+        return fetch_case(case_id, self.token, session)
+
+    def prefetch(self, case_ids):
+        for case_id in case_ids:
+            if case_id and case_id not in self._pending:
+                self._pending[case_id] = self._pool.submit(self._fetch, case_id)
+
+    def pop(self, case_id):
+        """The prefetched payload, or None if there is none or the GET failed."""
+        future = self._pending.pop(case_id, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def discard(self, case_id):
+        future = self._pending.pop(case_id, None)
+        if future is not None:
+            future.cancel()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pending.clear()
+        for session in self._sessions:
+            session.close()
+        self._sessions.clear()
+
+
+def post_case(filtered_data, token) -> bool:
+    """Mark the case 'Faktura sendt'. True if Vejman answered with the case. Raises on HTTP errors, incl. 409 for a stale version."""
+    filtered_data = dict(filtered_data)
     # Add "$transaction" and "$changed" nodes
     filtered_data["authority_reference_number"] = "Faktura sendt"
     filtered_data["$transaction"] = "update"
@@ -37,13 +107,32 @@ def update_case(case_id, token):
         'Content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
     }
 
-    response = requests.post(post_url, headers=headers, data=payload)
+    response = http.post(post_url, headers=headers, data=payload)
     response.raise_for_status()
 
     post_response_data = response.json()
 
     # Check if 'data' key exists in response and compare 'id'
-    if 'data' in post_response_data and post_response_data['data'].get('id') == filtered_data.get('id'):
+    return 'data' in post_response_data and post_response_data['data'].get('id') == filtered_data.get('id')
+
+
+def update_case(case_id, token, cache: CaseCache = None):
+    filtered_data = cache.pop(case_id) if cache is not None else None
+    from_cache = filtered_data is not None
+    if not from_cache:
+        filtered_data = fetch_case(case_id, token)
+
+    try:
+        ok = post_case(filtered_data, token)
+    except requests.HTTPError as e:
+        if not from_cache or e.response is None or e.response.status_code != 409:
+            raise
+        # The case changed after it was prefetched (version conflict): fetch it again and retry once
+        print(f"Case ID {filtered_data.get('id')}: version conflict, fetching the case again")
+        filtered_data = fetch_case(case_id, token)
+        ok = post_case(filtered_data, token)
+
+    if ok:
         print(f"Case ID {filtered_data['id']}: Data updated successfully!")
     else:
-        print(f"Case ID {filtered_data['id']}: Failed to update data, no matching ID found.")
\ No newline at end of file
+        print(f"Case ID {filtered_data['id']}: Failed to update data, no matching ID found.")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+
+# Entry point for the robot and its tools:
+#   python vejmankassen.py run [--drain] [--daemon]  invoice run (SAP, DB, Vejman)
+#   python vejmankassen.py verify [--full]     CPR/CVR audit of the invoice files
+#   python vejmankassen.py diff a.json b.json  JSON diff
+#   python vejmankassen.py reconcile [--date]  DB vs ZVF04 reconciliation
+#   python vejmankassen.py validate FILE...    structural check of invoice files
+# Each subcommand imports its own module, so the audit and diff tools never load
+# pyodbc, win32com, selenium or OpenOrchestrator.
+
+
+def _run(argv):
+    import sandbox
+    sandbox.main(argv)
+
+
+def _verify(argv):
+    import verify_cpr_cvr
+    verify_cpr_cvr.main(argv)
+
+
+def _diff(argv):
+    import test
+    return test.main(argv)
+
+
+def _reconcile(argv):
+    import reconcile
+    return reconcile.main(argv)
+
+
+def _validate(argv):
+    import zfi_validator
+    return zfi_validator.main(argv)
+
+
+COMMANDS = {
+    "run": _run,
+    "verify": _verify,
+    "diff": _diff,
+    "reconcile": _reconcile,
+    "validate": _validate,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vejmankassen")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments for the subcommand")
+    args = parser.parse_args(argv)
+    return COMMANDS[args.command](args.args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 from pathlib import Path
+import argparse
 import csv
+import io
+import json
+import os
 import re
 from datetime import date
+from functools import lru_cache
 
 FILENAME_REGEX = re.compile(r"^\d{4}-\d{2}-\d{2}_Fakturaer_\d{4}\.csv$")
 
@@ -80,6 +85,23 @@ def cvr_is_valid(num: str) -> bool:
     total = sum(int(d) * w for d, w in zip(num, weights))
     return total % 11 == 0
 
+# ---------------- Classification ----------------
+
+@lru_cache(maxsize=None)
+def classify_identifier(value: str) -> str:
+    """
+    Classify a customer identifier as it is sent to SAP (CvrNr, possibly
+    zero-padded to 10 digits). Returns "CVR", "CPR" or "neither".
+    An 8-digit number must pass the CVR Mod-11 check; a 10-digit number must
+    be a plausible CPR by date. Results are memoized per input.
+    """
+    cleaned = clean_number(value)
+    if len(cleaned) == 8:
+        return "CVR" if cvr_is_valid(cleaned) else "neither"
+    if len(cleaned) == 10:
+        return "CPR" if cpr_parse_and_checks(cleaned)["plausible_by_date"] else "neither"
+    return "neither"
+
 # ---------------- CSV utilities ----------------
 
 def read_first_row_second_col(csv_path: Path) -> str:
@@ -88,17 +110,21 @@ def read_first_row_second_col(csv_path: Path) -> str:
     Tries to sniff delimiter; falls back to comma.
     """
     with csv_path.open("r", newline="") as f:
-        sample = f.read(2048)
-        f.seek(0)
-        try:
-            dialect = csv.Sniffer().sniff(sample, delimiters=[",",";","\t","|"])
-        except csv.Error:
-            dialect = csv.get_dialect("excel")
-        reader = csv.reader(f, dialect)
-        for row in reader:
-            if not row or all(not c.strip() for c in row):
-                continue
-            return row[1] if len(row) > 1 else ""
+        return first_row_second_col(f)
+
+def first_row_second_col(f) -> str:
+    """Same as read_first_row_second_col, for an open text stream."""
+    sample = f.read(2048)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=[",",";","\t","|"])
+    except csv.Error:
+        dialect = csv.get_dialect("excel")
+    reader = csv.reader(f, dialect)
+    for row in reader:
+        if not row or all(not c.strip() for c in row):
+            continue
+        return row[1] if len(row) > 1 else ""
     return ""
 
 def clean_number(value: str) -> str:
@@ -109,58 +135,158 @@ def clean_number(value: str) -> str:
     digits = re.sub(r"\D", "", value or "")
     return digits[2:] if digits.startswith("00") else digits
 
+# ---------------- Incremental cache ----------------
+
+RESULTS_NAME = "faktura_id_check_results.csv"
+CACHE_NAME = "faktura_id_check_cache.json"
+
+RESULT_FIELDS = [
+    "filename",
+    "raw_second_column",
+    "cleaned_number",
+    "cpr_plausible_by_date",
+    "cpr_birthdate",
+    "cpr_mod11_pass",
+    "valid_cvr",
+    "classified_as",
+]
+
+def file_signature(path: Path) -> list:
+    """(size, mtime_ns) of a file; a change in either means re-validate."""
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+def load_cache(cache_path: Path) -> dict:
+    """
+    Return {filename: [size, mtime_ns]} for files already checked,
+    or an empty dict if the cache is missing or unreadable.
+    """
+    try:
+        with cache_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def save_cache(cache_path: Path, cache: dict) -> None:
+    tmp = cache_path.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    tmp.replace(cache_path)
+
+def load_results(out_path: Path) -> dict:
+    """Existing result rows keyed by filename (insertion ordered)."""
+    if not out_path.exists():
+        return {}
+    with out_path.open("r", encoding="utf-8", newline="") as f:
+        return {row["filename"]: row for row in csv.DictReader(f)}
+
+def iter_sources(cwd: Path):
+    """
+    Invoice files to check as (filename, cache key, signature, check function):
+    matching files in the directory, plus invoice files in the archive (see
+    invoice_archive), which are keyed by their content hash.
+    """
+    for entry in os.scandir(cwd):
+        if entry.is_file() and FILENAME_REGEX.match(entry.name):
+            csv_path = Path(entry.path)
+            yield entry.name, entry.name, file_signature(csv_path), lambda p=csv_path: check_file(p)
+
+    import invoice_archive
+    index_path = Path(invoice_archive.ARCHIVE_DIR) / "index.sqlite3"
+    if index_path.exists():
+        index = invoice_archive.open_archive(invoice_archive.ARCHIVE_DIR)
+        try:
+            for f in invoice_archive.iter_files(index, invoice_archive.KIND_FAKTURA):
+                def load(f=f):
+                    text = invoice_archive.read_file(index, f["sha256"]).decode("windows-1252")
+                    return check_value(f["original_name"], first_row_second_col(io.StringIO(text, newline="")))
+                yield f["original_name"], "arkiv:" + f["sha256"], [f["sha256"]], load
+        finally:
+            index.close()
+
 # ---------------- Main ----------------
 
-def main():
+def check_file(csv_path: Path) -> dict:
+    return check_value(csv_path.name, read_first_row_second_col(csv_path))
+
+def check_value(filename: str, raw: str) -> dict:
+    cleaned = clean_number(raw)
+
+    cpr = cpr_parse_and_checks(cleaned)
+    cvr_ok = cvr_is_valid(cleaned)
+
+    # Derived “type” label for convenience
+    types = []
+    if cpr["plausible_by_date"]:
+        types.append("CPR")
+    if cvr_ok:
+        types.append("CVR")
+    type_label = " & ".join(types) if types else "neither"
+
+    return {
+        "filename": filename,
+        "raw_second_column": raw,
+        "cleaned_number": cleaned,
+        "cpr_plausible_by_date": "yes" if cpr["plausible_by_date"] else "no",
+        "cpr_birthdate": cpr["birthdate"],
+        "cpr_mod11_pass": "yes" if cpr["mod11_pass"] else "no",
+        "valid_cvr": "yes" if cvr_ok else "no",
+        "classified_as": type_label,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check CPR/CVR numbers in generated invoice files.")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the cache and re-validate every file.")
+    args = parser.parse_args(argv)
+
     cwd = Path(__file__).resolve().parent
-    inputs = sorted(p for p in cwd.iterdir() if p.is_file() and FILENAME_REGEX.match(p.name))
-
-    results = []
-    for csv_path in inputs:
-        raw = read_first_row_second_col(csv_path)
-        cleaned = clean_number(raw)
-
-        cpr = cpr_parse_and_checks(cleaned)
-        cvr_ok = cvr_is_valid(cleaned)
-
-        # Derived “type” label for convenience
-        types = []
-        if cpr["plausible_by_date"]:
-            types.append("CPR")
-        if cvr_ok:
-            types.append("CVR")
-        type_label = " & ".join(types) if types else "neither"
-
-        results.append({
-            "filename": csv_path.name,
-            "raw_second_column": raw,
-            "cleaned_number": cleaned,
-            "cpr_plausible_by_date": "yes" if cpr["plausible_by_date"] else "no",
-            "cpr_birthdate": cpr["birthdate"],
-            "cpr_mod11_pass": "yes" if cpr["mod11_pass"] else "no",
-            "valid_cvr": "yes" if cvr_ok else "no",
-            "classified_as": type_label,
-        })
-
-    out_path = cwd / "faktura_id_check_results.csv"
-    with out_path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=[
-                "filename",
-                "raw_second_column",
-                "cleaned_number",
-                "cpr_plausible_by_date",
-                "cpr_birthdate",
-                "cpr_mod11_pass",
-                "valid_cvr",
-                "classified_as",
-            ],
-        )
-        writer.writeheader()
-        writer.writerows(results)
-
-    print(f"Wrote {len(results)} rows to {out_path.name}")
+    out_path = cwd / RESULTS_NAME
+    cache_path = cwd / CACHE_NAME
+
+    # The cache is only trusted together with the results file it describes
+    results = {} if args.full else load_results(out_path)
+    cache = load_cache(cache_path) if results else {}
+
+    new_rows, checked, changed = [], 0, False
+    seen_names, seen_keys = set(), set()
+    for name, key, signature, load in iter_sources(cwd):
+        seen_names.add(name)
+        seen_keys.add(key)
+        if cache.get(key) == signature and name in results:
+            continue
+        row = load()
+        checked += 1
+        if name in results:
+            changed = True
+        else:
+            new_rows.append(row)
+        results[name] = row
+        cache[key] = signature
+
+    # Forget files that were deleted or renamed since the last scan
+    stale = [name for name in results if name not in seen_names]
+    for name in stale:
+        del results[name]
+    cache = {key: sig for key, sig in cache.items() if key in seen_keys}
+    changed = changed or bool(stale)
+
+    if args.full or changed or not out_path.exists():
+        # Rewrite the merged result set
+        rows = sorted(results.values(), key=lambda r: r["filename"])
+        with out_path.open("w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    elif new_rows:
+        # Only new files: append them to the existing results
+        with out_path.open("a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writerows(sorted(new_rows, key=lambda r: r["filename"]))
+
+    save_cache(cache_path, cache)
+    print(f"Checked {checked} new/changed file(s); {len(results)} rows in {out_path.name}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import io
+import sys
+from typing import Iterable, List
+
+from sap_layouts import INVOICE_HEADER, INVOICE_LINE
+
+# Local structural check of ZFI_FAKTURAGRUNDLAG input files against the H/L layouts
+# in sap_layouts. Errors use the shape of the SAP error list ("Række N: text", rows
+# counted from 1), so a file that fails here never costs a SAP test run.
+
+ENCODING = "windows-1252"
+LAYOUTS = {"H": INVOICE_HEADER, "L": INVOICE_LINE}
+
+
+def validate_rows(rows: Iterable[List[str]], encoding: str = ENCODING) -> List[str]:
+    errors = []
+    seen_header = False
+    count = 0
+    for number, row in enumerate(rows, start=1):
+        count = number
+        record_type = row[0] if row else ""
+        layout = LAYOUTS.get(record_type)
+        if layout is None:
+            errors.append(f"Række {number}: ukendt recordtype '{record_type}' (forventede H eller L)")
+            continue
+        if record_type == "H":
+            seen_header = True
+        elif not seen_header:
+            errors.append(f"Række {number}: L-linje uden forudgående H-linje")
+        for cell in row:
+            try:
+                cell.encode(encoding)
+            except UnicodeEncodeError:
+                errors.append(f"Række {number}: '{cell}' kan ikke skrives i {encoding}")
+        errors.extend(f"Række {number}: {problem}" for problem in layout.check(row))
+    if count == 0:
+        errors.append("Række 1: filen er tom")
+    return errors
+
+
+def validate_file(path: str, encoding: str = ENCODING) -> List[str]:
+    """Errors in an invoice file, empty if it is structurally valid."""
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError as e:
+        line = data[:e.start].count(b"\n") + 1
+        return [f"Række {line}: ugyldigt tegn for {encoding} ved byte {e.start}"]
+    return validate_rows(csv.reader(io.StringIO(text, newline=""), delimiter=";"), encoding)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate ZFI_FAKTURAGRUNDLAG invoice files locally.")
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for path in args.files:
+        errors = validate_file(path)
+        if errors:
+            failed += 1
+            print(f"{path}:")
+            for error in errors:
+                print(f"  {error}")
+    print(f"{len(args.files)} fil(er) kontrolleret, {failed} med fejl")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
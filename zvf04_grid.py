@@ -0,0 +1,113 @@
+import re
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+# Streaming parser for the ZVF04 result list (lbl[col,row] labels under wnd[0]/usr).
+# Row 1 is the header and data rows are the odd rows from 3. A record is complete
+# when the labels move on to another row, and is checked before it is handed on.
+# Only the header and the current row are held in memory, whatever the size of the
+# release; a caller that must not keep the rows of a failed release stages them.
+
+LBL_RE = re.compile(r".*/lbl\[(\d+),(\d+)\]$")
+PREVIEW = 10   # Offending rows/labels quoted in error messages
+
+
+def norm_header(s: str) -> str:
+    # Normalize headers like "Opret. d." -> "Opret. d." (keep dots), but trim/space-normalize
+    return " ".join((s or "").strip().split())
+
+
+def is_fejl(header: str) -> bool:
+    return header.lower().strip(".:") == "fejl"
+
+
+def _preview(items) -> str:
+    return ", ".join(items[:PREVIEW]) + (" ..." if len(items) > PREVIEW else "")
+
+
+def iter_cells(container) -> Iterator[Tuple[int, int, str]]:
+    """(col, row, text) for each grid label under container, in SAP's order."""
+    outside = []
+    for child in container.Children:
+        if "lbl" not in child.Id:
+            continue
+        m = LBL_RE.match(child.Id)
+        if not m:
+            # Label under usr but not in the lbl[i,j] grid -> not part of table
+            if len(outside) < PREVIEW + 1:
+                outside.append(f"{child.Id}='{getattr(child, 'Text', '').strip()}'")
+            continue
+        try:
+            text = (child.Text or "").strip()
+        except Exception:
+            text = ""
+        yield int(m.group(1)), int(m.group(2)), text
+    # Make sure we only have table labels
+    if outside:
+        raise RuntimeError("Der findes labels udenfor tabellen (ikke i formatet lbl[col,row]): " + _preview(outside))
+
+
+def iter_records(cells: Iterable[Tuple[int, int, str]]) -> Iterator[dict]:
+    """
+    Yield each data row as {header: value} as soon as it is complete, holding only the
+    header and the current row. Cells are keyed by their lbl[col,row] position, so the
+    columns of a row may come in any order; a row whose labels are split up raises.
+    Every row is checked (odd row >= 3, empty 'Fejl' cell) before it is yielded, so
+    a bad row stops the stream before it reaches the caller.
+    """
+    headers = {}          # col -> header text
+    columns = None        # header cols in order, fixed at the first data row
+    fejl_col = None
+    current_row, current = None, {}
+    done = set()          # numbers of the rows already yielded (not their cells)
+
+    def finish():
+        value = current.get(fejl_col, "").strip()
+        if value:
+            raise RuntimeError(f"Fejl-kolonnen skal være tom i alle rækker, men række {(current_row - 1) // 2} "
+                               f"har værdien '{value}'")
+        done.add(current_row)
+        return {headers[c]: current.get(c, "") for c in columns}
+
+    for col, row, text in cells:
+        if row == 1:
+            if columns is not None:
+                raise RuntimeError(f"Header-label [{col},1]='{text}' kommer efter datarækkerne")
+            headers[col] = norm_header(text)
+            continue
+        # Sanity checks: rows only 1 or odd >=3 (else it's probably not the table)
+        if row < 3 or row % 2 == 0:
+            raise RuntimeError(f"Uventet label-række (ikke row=1 eller en ulige række >=3): [{col},{row}]='{text}'")
+        if columns is None:
+            if not headers:
+                raise RuntimeError("Ingen tabel-headers (row=1) fundet.")
+            columns = sorted(headers)
+            fejl_col = next((c for c in columns if is_fejl(headers[c])), None)
+            if fejl_col is None:
+                raise RuntimeError("Kolonnen 'Fejl' blev ikke fundet i header-rækken.")
+        if row != current_row:
+            if current_row is not None:
+                yield finish()
+            if row in done:
+                raise RuntimeError(f"Label [{col},{row}] kommer efter at række {(row - 1) // 2} er afsluttet; "
+                                   "rækkens labels ligger ikke samlet")
+            current_row, current = row, {}
+        current[col] = text
+
+    if columns is None:
+        # No data rows: the header must still be there and contain Fejl
+        if not headers:
+            raise RuntimeError("Ingen tabel-headers (row=1) fundet.")
+        if not any(is_fejl(h) for h in headers.values()):
+            raise RuntimeError("Kolonnen 'Fejl' blev ikke fundet i header-rækken.")
+    elif current_row is not None:
+        yield finish()
+
+
+def parse_grid(container, sink: Optional[Callable[[dict], None]] = None) -> int:
+    """Validate the ZVF04 result list in container, passing each record to sink. Returns the row count."""
+    count = 0
+    for record in iter_records(iter_cells(container)):
+        if sink is not None:
+            sink(record)
+        count += 1
+    return count